@@ -6,7 +6,10 @@ from device.eastron import SDM  # Powermeter with Modbus
 from device.fronius import Symo  # PV Inverter
 from device.goe_api_v2 import GoeApiV2  # GO-E Wallbox
 from device.json_request import JsonRequest  # HTTP API for Battery system
+from device.rs485 import Bus  # RS485 bus arbiter for the Eastron meters
 from device.sml import Sml  # IP Coupler interface to grid power meter
+from utils.acquisition import Acquisition
+from utils.command import CommandQueue
 
 
 class App:
@@ -20,8 +23,6 @@ class App:
                                ('bat_soc', 10))
 
 
-        self.command = {'goe': None}  # enable commands with a key
-
         self.sml = Sml(port=config.sml_ir_port, lifetime=10, log_name='mt175')
         self.sdm630 = SDM(config.eastron_sdm_port, type="SDM630", address=1, lifetime=10, log_name='sdm630')
         self.sdm72 = SDM(config.eastron_sdm_port, type="SDM72", address=3, lifetime=10, log_name='sdm72')
@@ -30,26 +31,44 @@ class App:
         self.goe = GoeApiV2(config.goe_wallbox_address, log_name='goe', lifetime=30)  # 30sec because of weak WiFi
         self.water = JsonRequest(config.water_meter_address, lifetime=10 * 60 + 10, log_name='water')  # Water-Meter
 
-        self.pv.start_tread(thread_sleep=0.5)  # read fronius in extra thread
-
-    def work(self, data, minute=False):
-
-        # handle received commands (/command/<target>?...)
-        if self.command['goe']:
-            self.log.info("goe wallbox command: {}".format(self.command['goe']))
-            if not self.goe.set(self.command['goe']):
-                self.log.info("retry goe wallbox command: {}".format(self.command))
-                self.goe.set(self.command['goe'])  # second try
-            self.command['goe'] = None
+        # enable commands with a target, executed in background by a worker per target (/command/<target>?...)
+        self.command = CommandQueue({'goe': self.goe.set})
+
+        self.rs485 = Bus.get(config.eastron_sdm_port)  # queues the transactions of all SDM meters
+
+        # poll intervals in seconds for every device or key, 0 for every cycle
+        # devices on the same serial port are read one after another, all transports in parallel
+        # the SDM meters submit their transactions in parallel, the bus arbiter serves them by priority
+        self.acquisition = Acquisition()
+        self.acquisition.add('sdm120', self.sdm120.read,
+                             keys={'p': 1, 'e_import': 30, 'e_export': 30})  # flat
+        self.acquisition.add('sdm630', self.sdm630.read,
+                             keys={'p': 1, 'e_total': 30,  # home  (legacy e_total, import is better)
+                                   'u1': 1, 'u2': 1, 'u3': 1, 'i1': 1, 'i2': 1, 'i3': 1,  # phases for load balancing
+                                   'p1': 1, 'p2': 1, 'p3': 1, 'pf1': 1, 'pf2': 1, 'pf3': 1, 'f': 1})  # one block read
+        self.acquisition.add('sdm72', self.sdm72.read,
+                             keys={'p': 1, 'e_total': 30})  # flat  (legacy e_total, import is better)
+        self.acquisition.add('sml', self.sml.read, transport=config.sml_ir_port)  # read IR coupler
+        self.acquisition.add('goe', self.goe.read, interval=1)  # read Wallbox
+        self.acquisition.add('pv', self.pv.read, interval=2, wait=False)  # fronius needs 1.5-4s, read in background
+        self.acquisition.add('water', self.water.read, interval=60)
+
+    def status(self):
+        """
+        Runtime statistics of the devices, served by /status
+
+        :return: Dictionary
+        """
+        devices = {'sdm120': self.sdm120, 'sdm630': self.sdm630, 'sdm72': self.sdm72,
+                   'goe': self.goe, 'pv': self.pv, 'water': self.water}
+        return {'rs485': self.rs485.stats(),  # transactions, errors, open and buffer resets of the RS485 port
+                'command': self.command.stats(),  # executed, failed and superseded commands
+                'breaker': {name: device.breaker.stats() for name, device in devices.items()}}  # offline devices
+
+    def work(self, data, t=None):
 
         # read devices
-        self.sdm120.read(['p', 'e_import', 'e_export'])  # flat
-        self.sdm630.read(['p', 'e_total'])  # home  (legacy e_total, import is better)
-        self.sdm72.read(['p', 'e_total'])  # flat  (legacy e_total, import is better)
-        self.sml.read()  # read IR coupler
-        self.goe.read()  # read Wallbox
-        if minute:  # water read only once a minute
-            self.water.read()
+        timing = self.acquisition.run(t)  # only devices and keys which are due
 
         # Grid meter
         data['grid_imp_eto'] = self.sml.get('e_import')  # MT175
@@ -69,6 +88,8 @@ class App:
         data['home_all_eto'] = self.sdm630.get('e_total')  # SDM630, Haus Gesamtverbrauch
         data['home_all_p'] = self.sdm630.get('p')
         data['home_p'] = self.sdm630.get('p', default=0) - self.goe.get('p', default=0)
+        for k in ('u1', 'u2', 'u3', 'i1', 'i2', 'i3', 'p1', 'p2', 'p3', 'pf1', 'pf2', 'pf3', 'f'):
+            data['home_' + k] = self.sdm630.get(k)  # SDM630, per phase
 
         # Flat
         data['flat_eto'] = self.sdm72.get('e_total')  # SDM72, Einliegerwohnung
@@ -91,6 +112,11 @@ class App:
         # Water
         data['water_vto'] = self.water.get(('main', 'value'))
 
+        # Read time per device in seconds, None if not read in this cycle (background: no read completed)
+        for name, t in timing.items():
+            data['measure_' + name] = t
+        data['rs485_load'] = self.rs485.load(getattr(config, 'cycle_time', 1))  # bus utilisation in % of the cycle
+
 
 """ Example: Full dataset 
 {    
@@ -109,6 +135,19 @@ class App:
      "home_all_eto": 15159336, 
      "home_all_p": 305, 
      "home_p": 305, 
+     "home_u1": 231.2,
+     "home_u2": 230.4,
+     "home_u3": 232.0,
+     "home_i1": 1.12,
+     "home_i2": 0.45,
+     "home_i3": 0.31,
+     "home_p1": 214,
+     "home_p2": 58,
+     "home_p3": 33,
+     "home_pf1": 0.826,
+     "home_pf2": 0.561,
+     "home_pf3": 0.464,
+     "home_f": 50.01,
      "flat_eto": 67189, 
      "flat_p": 0,
      "bat_imp_eto": 1859088, 
@@ -123,9 +162,17 @@ class App:
      "car_stop": True, 
      "car_state": "complete", 
      "water_vto": 1367154,
+     "measure_sdm120": 0.213,
+     "measure_sdm630": 0.142,
+     "measure_sdm72": 0.141,
+     "measure_sml": 0.001,
+     "measure_goe": 0.087,
+     "measure_pv": 1.534,
+     "measure_water": None,
+     "rs485_load": 34.2,
      "car_mode": "pv", 
      "car_pv_ready": False, 
      "bat_soc": 46, 
-     "measure_time": 0.862
+     "measure_time": 0.502
 }
 """
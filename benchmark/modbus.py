@@ -0,0 +1,90 @@
+"""
+Microbenchmark for the Modbus RTU paths of minimalmodbus (CPU time only)
+
+The serial port is replaced by a canned slave response and the silent period is set to zero, so only the CPU time
+for building the request, checking and decoding the response is measured.
+
+python3 -m benchmark.modbus
+"""
+
+import struct
+import timeit
+from device import minimalmodbus
+
+
+class CannedSerial:
+    """
+    Serial port replacement, answers every request with a prepared response.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.port = 'bench'
+        self.baudrate = 9600
+        self.timeout = 0.1
+        self.is_open = True
+
+    def write(self, data):
+        return len(data)
+
+    def read(self, size):
+        return self.response
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+
+def response(address, functioncode, count):
+    """
+    Build a valid read response with float values 230.1, 230.2, ...
+    """
+    data = b''.join(struct.pack('>f', 230 + i / 10) for i in range(count // 2))
+    frame = struct.pack('>BBB', address, functioncode, count * 2) + data
+    return frame + struct.pack('<H', minimalmodbus._calculate_crc_bytes(frame))
+
+
+def bench(name, function, number):
+    t = min(timeit.repeat(function, number=number, repeat=5)) / number
+    print("{:<45} {:>9.1f} us".format(name, t * 1e6))
+    return t
+
+
+def main(number=2000):
+    minimalmodbus._calculate_minimum_silent_period = lambda baudrate: 0  # CPU time only, no bus timing
+
+    t_fast = {}
+    for count in (2, 64):
+        minimalmodbus._serialports['bench'] = CannedSerial(response(2, 4, count))
+        instrument = minimalmodbus.Instrument('bench', 2)
+        request = instrument.precompile_read_registers(12, count, functioncode=4)
+        fmt = '>{}f'.format(count // 2)
+
+        def legacy():
+            registers = instrument.read_registers(12, count, functioncode=4)
+            return struct.unpack(fmt, struct.pack('>{}H'.format(count), *registers))
+
+        def fast():
+            return struct.unpack(fmt, instrument.read_precompiled(request))
+
+        assert legacy() == fast()
+        t_legacy = bench("read_registers {} registers + float decode".format(count), legacy, number)
+        t_fast[count] = bench("read_precompiled {} registers + float decode".format(count), fast, number)
+        print("{:<45} {:>9.1f} x".format("speedup", t_legacy / t_fast[count]))
+
+    minimalmodbus._serialports['bench'] = CannedSerial(response(2, 4, 2))
+    instrument = minimalmodbus.Instrument('bench', 2)
+    t_float = bench("read_float x3 (p, e_import, e_export)",
+                    lambda: [instrument.read_float(r, 4) for r in (12, 72, 74)], number)
+    print("{:<45} {:>9.1f} x".format("speedup 1 precompiled block of 64", t_float / t_fast[64]))
+
+    frame = response(2, 4, 64)
+    text = str(frame[:-2], encoding='latin1')
+    bench("CRC string (minimalmodbus) 131 bytes", lambda: minimalmodbus._calculate_crc_string(text), number)
+    bench("CRC bytes (fast path) 131 bytes", lambda: minimalmodbus._calculate_crc_bytes(frame[:-2]), number)
+
+
+if __name__ == "__main__":
+    main()
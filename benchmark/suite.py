@@ -0,0 +1,500 @@
+"""
+Benchmark suite for the hot paths of MeterHub, with tracked baseline
+
+Every case measures the time for a single operation in microseconds (best of 5 repeats). Cases below 1 ms are run
+several rounds and the best round counts, a single round is easily disturbed by other processes. The results are
+compared with benchmark/baseline.json, a case slower than baseline * (1 + tolerance) and more than the noise floor
+(1 us) is reported as regression and the suite exits with 1. Baselines are machine specific, save a new one after
+changes of the hardware or Python version.
+
+python3 -m benchmark.suite                  # run and compare with baseline
+python3 -m benchmark.suite -k trace         # only cases containing 'trace'
+python3 -m benchmark.suite --save           # run and save the results as new baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import timeit
+
+baseline_file = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+cases = []  # (name, function, tolerance), function returns time per operation in seconds
+noise_floor = 1.0  # us, smaller differences to the baseline are not a regression
+short_case = 1e-3  # s, cases below are run several rounds
+
+
+def case(name, tolerance=0.3):
+    """
+    Register a benchmark case
+
+    :param name: name of the case, e.g. 'sml.calc_crc'
+    :param tolerance: allowed slowdown relative to the baseline, 0.3 for 30%
+    """
+    def register(function):
+        cases.append((name, function, tolerance))
+        return function
+    return register
+
+
+def measure(function, number, repeat=5):
+    """
+    :return: best time per call in seconds
+    """
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def dataset(i=0):
+    """
+    Full MeterHub dataset (as in App.work) with slightly varying values
+
+    :param i: number of the dataset, one second per dataset
+    """
+    t = 1664049957 + i
+    r = random.Random(i)
+    data = {'time': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t)), 'timestamp': t,
+            'grid_imp_eto': 4539537 + i // 10, 'grid_exp_eto': 30636590, 'grid_p': r.randint(-3000, 3000),
+            'pv1_eto': 23824702, 'pv2_eto': 15919000, 'pv1_e_day': 0, 'pv2_e_day': 0,
+            'pv1_p': r.randint(0, 4500), 'pv2_p': r.randint(0, 3000), 'pv_p': r.randint(0, 7500),
+            'home_all_eto': 15159336, 'home_all_p': r.randint(200, 3000), 'home_p': r.randint(200, 3000)}
+    for k in ('u1', 'u2', 'u3'):
+        data['home_' + k] = round(r.uniform(228, 233), 1)
+    for k in ('i1', 'i2', 'i3'):
+        data['home_' + k] = round(r.uniform(0, 10), 2)
+    for k in ('p1', 'p2', 'p3'):
+        data['home_' + k] = r.randint(0, 2000)
+    for k in ('pf1', 'pf2', 'pf3'):
+        data['home_' + k] = round(r.uniform(0.4, 1), 3)
+    data['home_f'] = round(r.uniform(49.95, 50.05), 2)
+    data.update({'flat_eto': 67189, 'flat_p': r.randint(0, 500), 'bat_imp_eto': 1859088, 'bat_exp_eto': 900169,
+                 'bat_p': r.randint(-2000, 2000), 'car_eto': 2487641, 'car_p': 0, 'car_e_cycle': 2506, 'car_amp': 7,
+                 'car_phase': 1, 'car_stop': r.random() < 0.5, 'car_state': r.choice(('idle', 'charge', 'complete')),
+                 'water_vto': 1367154, 'measure_sdm120': 0.045, 'measure_sdm630': 0.142, 'measure_sdm72': None,
+                 'measure_sml': 0.001, 'measure_goe': round(r.uniform(0.02, 0.2), 3), 'measure_pv': 1.534,
+                 'measure_water': None, 'rs485_load': 34.2, 'car_mode': 'pv', 'car_pv_ready': False, 'bat_soc': 46,
+                 'bat_info': None, 'car_info': None, 'car_plug': None, 'measure_time': 0.502})
+    return data
+
+
+def datasets(n, pool=100):
+    """
+    List with n datasets, the objects of a pool are repeated (memory)
+    """
+    pool = [dataset(i) for i in range(pool)]
+    return [pool[i % len(pool)] for i in range(n)]
+
+
+# --- SML ---
+
+def sml_frames():
+    from device.sml import Sml
+    from simulator.serial_devices import sml_frame
+    return Sml(), sml_frame(4539537, 30636590, 304, 'MT175'), sml_frame(4539537, 30636590, -304, 'eHZ')
+
+
+@case('sml.calc_crc')
+def bench_sml_calc_crc():
+    sml, frame, _ = sml_frames()
+    return measure(lambda: sml.calc_crc(frame[:-2]), 500)
+
+
+@case('sml.get_frame')
+def bench_sml_get_frame():
+    sml, frame, _ = sml_frames()
+    buffer = b'\x00' * 100 + frame + frame[:120]  # noise, complete frame, partial frame
+    return measure(lambda: sml.get_frame(buffer), 5000)
+
+
+@case('sml.decode_frame MT175')
+def bench_sml_decode_frame_mt175():
+    sml, frame, _ = sml_frames()
+    return measure(lambda: sml.decode_frame(frame), 500)
+
+
+@case('sml.decode_frame eHZ')
+def bench_sml_decode_frame_ehz():
+    sml, _, frame = sml_frames()
+    return measure(lambda: sml.decode_frame(frame), 500)
+
+
+@case('sml.get_obis')
+def bench_sml_get_obis():
+    sml, frame, _ = sml_frames()
+    return measure(lambda: sml.get_obis(frame, b'\x77\x07\x01\x00\x01\x08\x00\xff'), 5000)
+
+
+# --- Modbus ---
+
+@case('modbus.crc string 131 bytes')
+def bench_modbus_crc_string():
+    from device import minimalmodbus
+    text = str(bytes(range(131)), encoding='latin1')
+    return measure(lambda: minimalmodbus._calculate_crc_string(text), 2000)
+
+
+@case('modbus.crc bytes 131 bytes')
+def bench_modbus_crc_bytes():
+    from device import minimalmodbus
+    frame = bytes(range(131))
+    return measure(lambda: minimalmodbus._calculate_crc_bytes(frame), 2000)
+
+
+@case('modbus.float encode')
+def bench_modbus_float_encode():
+    from device import minimalmodbus
+    return measure(lambda: minimalmodbus._float_to_bytestring(230.1), 20000)
+
+
+@case('modbus.float decode')
+def bench_modbus_float_decode():
+    from device import minimalmodbus
+    bytestring = minimalmodbus._float_to_bytestring(230.1)
+    return measure(lambda: minimalmodbus._bytestring_to_float(bytestring), 20000)
+
+
+@case('modbus.read_precompiled 64 registers')
+def bench_modbus_read_precompiled():
+    import struct
+    from device import minimalmodbus
+    from benchmark.modbus import CannedSerial, response
+    silent_period = minimalmodbus._calculate_minimum_silent_period
+    minimalmodbus._calculate_minimum_silent_period = lambda baudrate: 0  # CPU time only, no bus timing
+    try:
+        minimalmodbus._serialports['bench'] = CannedSerial(response(2, 4, 64))
+        instrument = minimalmodbus.Instrument('bench', 2)
+        request = instrument.precompile_read_registers(12, 64, functioncode=4)
+        return measure(lambda: struct.unpack('>32f', instrument.read_precompiled(request)), 5000)
+    finally:
+        minimalmodbus._calculate_minimum_silent_period = silent_period  # later cases (app.work) with bus timing
+        minimalmodbus._serialports.pop('bench', None)
+
+
+# --- Trace ---
+
+def trace_filled(size):
+    from utils.trace import Trace
+    trace = Trace(size=size)
+    for d in datasets(size):
+        trace.push(d)
+    return trace
+
+
+@case('trace.push 600')
+def bench_trace_push_600():
+    trace, data = trace_filled(600), dataset()
+    return measure(lambda: trace.push(data), 2000)
+
+
+@case('trace.push 86400')
+def bench_trace_push_86400():
+    trace, data = trace_filled(86400), dataset()
+    return measure(lambda: trace.push(data), 2000)
+
+
+@case('trace.view 86400 (iterate)')
+def bench_trace_view_86400():
+    trace = trace_filled(86400)
+    return measure(lambda: sum(1 for d in trace.view()), 5, repeat=3)
+
+
+@case('trace.set_size 86400 -> 43200')
+def bench_trace_set_size():
+    trace = trace_filled(86400)
+
+    def resize():
+        trace.set_size(43200)
+        trace.set_size(86400)
+
+    return measure(resize, 5, repeat=3) / 2
+
+
+@case('trace.get_csv 600')
+def bench_trace_get_csv_600():
+    trace = trace_filled(600)
+    return measure(trace.get_csv, 5, repeat=3)
+
+
+@case('trace.get_csv 86400')
+def bench_trace_get_csv_86400():
+    trace = trace_filled(86400)
+    return measure(trace.get_csv, 1, repeat=3)
+
+
+def trace_day():
+    """
+    Trace with a day of datasets and increasing timestamps (since, aggregation)
+    """
+    from utils.trace import Trace
+    trace = Trace(size=86400)
+    for i, d in enumerate(datasets(86400)):
+        trace.push(dict(d, timestamp=1664049957 + i))
+    return trace
+
+
+@case('trace.iter_json since, 60 of 86400 rows')
+def bench_trace_iter_json_since():
+    trace = trace_day()
+    since = 1664049957 + 86400 - 61
+    return measure(lambda: ''.join(trace.iter_json(since=since)), 200)
+
+
+@case('trace.iter_json 86400 (streaming)')
+def bench_trace_iter_json_86400():
+    trace = trace_filled(86400)
+    return measure(lambda: sum(len(text) for text in trace.iter_json()), 1, repeat=3)
+
+
+@case('trace.aggregate 86400, bucket 60, 3 keys')
+def bench_trace_aggregate():
+    trace = trace_day()
+
+    def run():
+        trace.cache.clear()
+        return trace.aggregate(('grid_p', 'pv_p', 'home_p'), 60, ('min', 'max', 'avg'))
+    return measure(run, 1, repeat=5)
+
+
+@case('trace.aggregate 86400, bucket 60, 3 keys (cached)')
+def bench_trace_aggregate_cached():
+    trace = trace_day()
+    trace.aggregate(('grid_p', 'pv_p', 'home_p'), 60, ('min', 'max', 'avg'))
+    return measure(lambda: trace.aggregate(('grid_p', 'pv_p', 'home_p'), 60, ('min', 'max', 'avg')), 3, repeat=5)
+
+
+@case('trace.lttb 86400 -> 500, 1 key')
+def bench_trace_lttb():
+    trace = trace_day()
+    return measure(lambda: trace.lttb(('grid_p',), 500), 1, repeat=5)
+
+
+# --- Backup ---
+
+@case('backup.push (one day, per push)')
+def bench_backup_push():
+    import config_sample
+    from utils.backup import Backup
+    data = dataset()
+    times = [time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1664064000 + i)) for i in range(86400)]
+
+    def day():
+        backup = Backup()
+        backup.config = config_sample.backup.config
+        backup.path = tempfile.mkdtemp()
+        for t in times:
+            data['time'] = t
+            backup.push(data)
+
+    return measure(day, 1, repeat=3) / len(times)
+
+
+# --- Webserver ---
+
+@case('snapshot.encode (per cycle)')
+def bench_snapshot_encode():
+    from utils.snapshot import Snapshot
+    data = dataset()
+    return measure(lambda: Snapshot(data, 1), 2000)
+
+
+@case('snapshot.project 5 keys (first request)')
+def bench_snapshot_project():
+    from utils.snapshot import Snapshot
+    snapshot = Snapshot(dataset(), 1)
+
+    def first():
+        snapshot.projections.clear()
+        return snapshot.project('grid_p,pv_p,bat_p,car_p,car_state')
+
+    return measure(first, 5000)
+
+
+@case('snapshot.project 5 keys (cached)')
+def bench_snapshot_project_cached():
+    from utils.snapshot import Snapshot
+    snapshot = Snapshot(dataset(), 1)
+    return measure(lambda: snapshot.project('grid_p,pv_p,bat_p,car_p,car_state'), 5000)
+
+
+@case('binary.encode (per cycle)')
+def bench_binary_encode():
+    from utils.binary import BinaryEncoder
+    encoder, data = BinaryEncoder(), dataset()
+    encoder.encode(data)
+    return measure(lambda: encoder.encode(data, 1), 5000)
+
+
+@case('binary.unpack (client)')
+def bench_binary_unpack():
+    import struct
+    from utils.binary import BinaryEncoder
+    encoder = BinaryEncoder()
+    payload = encoder.encode(dataset())
+    unpack = struct.Struct(json.loads(encoder.schema)['format']).unpack
+    return measure(lambda: unpack(payload), 20000)
+
+
+@case('json.loads dataset (client)')
+def bench_json_loads():
+    from utils.snapshot import Snapshot
+    body = Snapshot(dataset()).body
+    return measure(lambda: json.loads(body), 5000)
+
+
+# --- Local consumers ---
+
+def shared_export():
+    from utils.shared import SharedExport, SharedReader
+    from utils.snapshot import Snapshot
+    path = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'meterhub_bench')
+    shared = SharedExport(path)
+    shared.write(Snapshot(dataset(), 1))
+    reader = SharedReader(path)
+    os.remove(path)  # the mappings stay valid
+    return shared, reader
+
+
+@case('shared.write (per cycle)')
+def bench_shared_write():
+    from utils.snapshot import Snapshot
+    shared, reader = shared_export()
+    snapshot = Snapshot(dataset(), 2)
+    return measure(lambda: shared.write(snapshot), 20000)
+
+
+@case('shared.get new dataset (read + json)')
+def bench_shared_get():
+    shared, reader = shared_export()
+
+    def get():
+        reader.generation = None  # as after a new cycle
+        return reader.get()
+
+    return measure(get, 5000)
+
+
+@case('shared.get unchanged dataset')
+def bench_shared_get_unchanged():
+    shared, reader = shared_export()
+    reader.get()
+    return measure(reader.get, 20000)
+
+
+@case('http GET / + json (local consumer)', tolerance=0.5)
+def bench_http_get():
+    import requests
+    from simulator.http_devices import HttpDevice
+    from utils.snapshot import Snapshot
+    body = Snapshot(dataset(), 1).body
+    device = HttpDevice(8104)
+    device.route('/', lambda: body)
+    device.start()
+    session = requests.Session()  # keep-alive, best case for polling
+    url = 'http://{}/'.format(device.address)
+    for i in range(50):
+        try:
+            session.get(url, timeout=1)
+            break
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)  # webserver startup
+    return measure(lambda: session.get(url, timeout=1).json(), 200)
+
+
+# --- App ---
+
+app = None  # App with simulated devices, created once
+
+
+def app_simulated():
+    """
+    App with simulated serial and HTTP devices (config module replaced)
+    """
+    global app
+    if app is None:
+        import types
+        import config_sample
+        from simulator import http_devices
+        from simulator.serial_devices import SdmBus, SmlMeter
+        sdm, sml, devices = SdmBus().start(), SmlMeter().start(), http_devices.start('lan')
+        config = types.ModuleType('config')
+        config.__dict__.update({k: v for k, v in vars(config_sample).items() if not k.startswith('__')})
+        config.eastron_sdm_port, config.sml_ir_port = sdm.port, sml.port
+        config.fronius_symo_address = devices['fronius'].address
+        config.goe_wallbox_address = devices['goe'].address
+        config.water_meter_address = devices['water'].url
+        sys.modules['config'] = config
+        from app import App
+        app = App()
+        time.sleep(0.5)  # webserver startup
+    return app
+
+
+@case('app.work cycle (simulated devices)', tolerance=0.5)
+def bench_app_work_cycle():
+    from utils.scheduler import Scheduler
+    app = app_simulated()
+    scheduler = Scheduler(period=0.5)
+    times = []
+    for i in range(12):
+        t0 = scheduler.wait()
+        app.work({}, t0)
+        times.append(time.perf_counter() - t0)
+    return sorted(times[2:])[len(times[2:]) // 2]  # median, without first cycles (connect, all keys due)
+
+
+@case('app.work assembly (no reads due)')
+def bench_app_work_assembly():
+    app = app_simulated()
+    t = time.perf_counter()
+    app.work({}, t)
+    return measure(lambda: app.work({}, t), 200)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MeterHub benchmark suite")
+    parser.add_argument('-k', default='', help="run only cases containing this string")
+    parser.add_argument('--save', action='store_true', help="save results as new baseline")
+    parser.add_argument('--rounds', type=int, default=3, help="rounds of the cases below 1 ms, the best counts")
+    args = parser.parse_args()
+
+    try:
+        baseline = json.load(open(baseline_file))
+    except IOError:
+        baseline = {'results': {}}
+
+    results = {}
+    regressions = []
+    print("{:<40} {:>12} {:>12} {:>8}".format('case', 'time [us]', 'baseline', 'ratio'))
+    for name, function, tolerance in cases:
+        if args.k not in name:
+            continue
+        t = function()
+        if t < short_case:
+            t = min([t] + [function() for i in range(args.rounds - 1)])
+        t *= 1e6
+        results[name] = round(t, 3)
+        base = baseline['results'].get(name)
+        ratio = t / base if base else None
+        flag = ''
+        if ratio and ratio > 1 + tolerance and t - base > noise_floor:
+            regressions.append(name)
+            flag = 'REGRESSION'
+        print("{:<40} {:>12.3f} {:>12} {:>8} {}".format(name, t, '{:.3f}'.format(base) if base else '-',
+                                                       '{:.2f}'.format(ratio) if ratio else '-', flag))
+
+    if args.save:
+        baseline = {'python': platform.python_version(), 'machine': platform.machine(),
+                    'date': time.strftime("%Y-%m-%d"), 'results': {**baseline['results'], **results}}
+        json.dump(baseline, open(baseline_file, 'w'), indent=2)
+        print("baseline saved: {}".format(baseline_file))
+    elif regressions:
+        print("{} regression(s): {}".format(len(regressions), ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -38,5 +38,20 @@ backup.ftp_config = {'server': '192.168.0.1',
                      'password': '*******',
                      'path': 'USB_STICK/MeterHub-Backup'}
 
+# Cycle time of the main loop in seconds (e.g. 1 or 0.25)
+cycle_time = 1
+
 # Port for the MeterHub Webserver
 webserver_port = 8008
+
+# Number of webserver threads, every waiting long-poll request (/next, /?wait=..) holds a thread
+webserver_threads = 16
+
+# Port for Server-Sent Events (/stream), separate server without a thread per subscriber, None to disable
+stream_port = 8009
+
+# Maximum size of the trace (/trace/<size>), about 250 bytes per dataset are allocated at once (4 days at 1 s: 86 MB)
+trace_max_size = 345600
+
+# Shared memory export of the latest dataset for local processes (utils/shared.py), None to disable
+shared_export = '/dev/shm/meterhub'
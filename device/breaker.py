@@ -0,0 +1,116 @@
+# Circuit Breaker for offline devices
+
+import logging
+import time
+
+
+class BreakerOpen(Exception):
+    """
+    Raised by Breaker.check() while the breaker is open.
+    """
+    pass
+
+
+class Breaker:
+    """
+    Circuit Breaker
+
+    Protects the cycle from the timeouts of an offline device. After `threshold` consecutive failures the breaker opens
+    and reads are skipped. After the backoff time a single probe read is allowed (half open). A successful probe closes
+    the breaker, a failed probe opens it again with a doubled backoff, up to the maximum. The device keeps serving its
+    cached data until the lifetime expires.
+
+    closed --(threshold failures)--> open --(backoff)--> half_open --(success)--> closed
+                                      ^                      |
+                                      +------(failure)-------+
+    """
+
+    def __init__(self, threshold=3, backoff=5, maximum=60, log_name='breaker'):
+        """
+        :param threshold: number of consecutive failures to open the breaker
+        :param backoff: first backoff time in seconds
+        :param maximum: maximum backoff time in seconds, period of the probes for a permanently offline device
+        """
+        self.log = logging.getLogger(log_name)
+        self.threshold = threshold
+        self.backoff_min = backoff
+        self.backoff_max = maximum
+        self.state = 'closed'  # 'closed', 'open' or 'half_open'
+        self.failures = 0  # consecutive failures
+        self.backoff = backoff  # current backoff time in seconds
+        self.t_probe = None  # time.perf_counter() for the next probe
+
+    def allow(self):
+        """
+        Check if a read is allowed. After the backoff time the breaker changes to half open for a single probe.
+
+        :return: True if the device should be read
+        """
+        if self.state == 'open' and time.perf_counter() >= self.t_probe:
+            self.state = 'half_open'
+            self.log.debug("half open, probe")
+        return self.state != 'open'
+
+    def check(self):
+        """
+        Same as allow(), but raises BreakerOpen if the read is not allowed.
+        """
+        if not self.allow():
+            raise BreakerOpen("circuit breaker open, probe in {:.0f}s".format(self.t_probe - time.perf_counter()))
+
+    def success(self):
+        """
+        Report a successful read, closes the breaker.
+        """
+        if self.state != 'closed':
+            self.log.info("closed after {} failures".format(self.failures))
+        self.state = 'closed'
+        self.failures = 0
+        self.backoff = self.backoff_min
+
+    def failure(self):
+        """
+        Report a failed read. Failures while open (skipped reads) are ignored.
+        """
+        if self.state == 'half_open':  # failed probe
+            self.failures += 1
+            self.backoff = min(self.backoff * 2, self.backoff_max)
+            self.trip()
+        elif self.state == 'closed':
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.trip()
+
+    def trip(self):
+        """
+        Open the breaker for the current backoff time.
+        """
+        if self.state == 'closed':
+            self.log.info("open after {} failures, backoff {}s".format(self.failures, self.backoff))
+        self.state = 'open'
+        self.t_probe = time.perf_counter() + self.backoff
+
+    def stats(self):
+        """
+        Get breaker state
+
+        :return: Dictionary
+        """
+        return {'state': self.state,
+                'failures': self.failures,
+                'backoff': self.backoff if self.state != 'closed' else None,
+                'probe': round(max(self.t_probe - time.perf_counter(), 0), 1) if self.state == 'open' else None}
+
+
+if __name__ == "__main__":
+    """
+    Simple Test for breaker module, offline device with short backoff
+    """
+    logging.basicConfig(level=logging.DEBUG)
+
+    breaker = Breaker(threshold=2, backoff=0.1, maximum=0.4)
+    for i in range(30):
+        if breaker.allow():
+            breaker.failure() if i < 20 else breaker.success()  # device online again after 2s
+            print(i, breaker.stats())
+        time.sleep(0.1)
@@ -3,11 +3,14 @@
 # 19.01.2022 Martin Steppuhn    Release
 
 import logging
+import struct
 import time
 try:
-    from device import minimalmodbus
+    from device.breaker import Breaker
+    from device.rs485 import Bus
 except:
-    import minimalmodbus
+    from breaker import Breaker
+    from rs485 import Bus
 
 
 class SDM:
@@ -17,13 +20,73 @@ class SDM:
     Read information from Eastron powermeters.
     With Lifetime a timeout for data can be specified. Even if there is an error or no read, data is still valid for
     the specified period.
-    """
 
-    cfg = {"SDM120": {'p': (0x0C, 1), 'e_total': (0x156, 1000), 'e_import': (0x48, 1000), 'e_export': (0x4A, 1000)},
-           "SDM72": {'p': (0x34, 1), 'e_total': (0x156, 1000)},
-           "SDM630": {'p': (0x34, 1), 'e_total': (0x156, 1000)}}
+    The requested keys are merged to blocks of contiguous registers (see plan()). Each block is read with a single
+    Modbus transaction and all floats are decoded from the response. The transactions of all meters on a port are
+    queued at the bus arbiter (device.rs485.Bus). Blocks with instantaneous values (e.g. 'p') are served before blocks
+    with only energy counters. An offline meter is skipped by a circuit breaker and probed periodically.
+    """
 
-    def __init__(self, port, type, address, lifetime=10, log_name='sdmx'):
+    # Input registers: key: (register, factor, digits)  value = round(float * factor, digits)
+    # u: voltage [V], i: current [A], p: power [W], s: apparent power [VA], q: reactive power [VAr], pf: power factor,
+    # phi: phase angle [°], f: frequency [Hz], e: energy [Wh], eq: reactive energy [VArh], thd: distortion [%]
+    # 1, 2, 3: phase L1, L2, L3  12, 23, 31: line to line
+    cfg = {"SDM120": {'u': (0x00, 1, 1), 'i': (0x06, 1, 2), 'p': (0x0C, 1, None), 's': (0x12, 1, None),
+                      'q': (0x18, 1, None), 'pf': (0x1E, 1, 3), 'phi': (0x24, 1, 1), 'f': (0x46, 1, 2),
+                      'e_import': (0x48, 1000, None), 'e_export': (0x4A, 1000, None),
+                      'eq_import': (0x4C, 1000, None), 'eq_export': (0x4E, 1000, None),
+                      'p_demand': (0x54, 1, None), 'p_demand_max': (0x56, 1, None),
+                      'p_import_demand': (0x58, 1, None), 'p_import_demand_max': (0x5A, 1, None),
+                      'p_export_demand': (0x5C, 1, None), 'p_export_demand_max': (0x5E, 1, None),
+                      'i_demand': (0x102, 1, 2), 'i_demand_max': (0x108, 1, 2),
+                      'e_total': (0x156, 1000, None), 'eq_total': (0x158, 1000, None)},
+
+           "SDM72": {'u1': (0x00, 1, 1), 'u2': (0x02, 1, 1), 'u3': (0x04, 1, 1),
+                     'i1': (0x06, 1, 2), 'i2': (0x08, 1, 2), 'i3': (0x0A, 1, 2),
+                     'p1': (0x0C, 1, None), 'p2': (0x0E, 1, None), 'p3': (0x10, 1, None),
+                     's1': (0x12, 1, None), 's2': (0x14, 1, None), 's3': (0x16, 1, None),
+                     'q1': (0x18, 1, None), 'q2': (0x1A, 1, None), 'q3': (0x1C, 1, None),
+                     'pf1': (0x1E, 1, 3), 'pf2': (0x20, 1, 3), 'pf3': (0x22, 1, 3),
+                     'u': (0x2A, 1, 1), 'i': (0x2E, 1, 2), 'i_sum': (0x30, 1, 2),
+                     'p': (0x34, 1, None), 's': (0x38, 1, None), 'q': (0x3C, 1, None), 'pf': (0x3E, 1, 3),
+                     'f': (0x46, 1, 2), 'e_import': (0x48, 1000, None), 'e_export': (0x4A, 1000, None),
+                     'u12': (0xC8, 1, 1), 'u23': (0xCA, 1, 1), 'u31': (0xCC, 1, 1), 'u_ll': (0xCE, 1, 1),
+                     'i_n': (0xE0, 1, 2), 'e_total': (0x156, 1000, None), 'eq_total': (0x158, 1000, None),
+                     'e_total_reset': (0x180, 1000, None), 'eq_total_reset': (0x182, 1000, None),
+                     'e_import_reset': (0x184, 1000, None), 'e_export_reset': (0x186, 1000, None),
+                     'e_net': (0x500, 1000, None), 'p_import': (0x502, 1, None), 'p_export': (0x504, 1, None)},
+
+           "SDM630": {'u1': (0x00, 1, 1), 'u2': (0x02, 1, 1), 'u3': (0x04, 1, 1),
+                      'i1': (0x06, 1, 2), 'i2': (0x08, 1, 2), 'i3': (0x0A, 1, 2),
+                      'p1': (0x0C, 1, None), 'p2': (0x0E, 1, None), 'p3': (0x10, 1, None),
+                      's1': (0x12, 1, None), 's2': (0x14, 1, None), 's3': (0x16, 1, None),
+                      'q1': (0x18, 1, None), 'q2': (0x1A, 1, None), 'q3': (0x1C, 1, None),
+                      'pf1': (0x1E, 1, 3), 'pf2': (0x20, 1, 3), 'pf3': (0x22, 1, 3),
+                      'phi1': (0x24, 1, 1), 'phi2': (0x26, 1, 1), 'phi3': (0x28, 1, 1),
+                      'u': (0x2A, 1, 1), 'i': (0x2E, 1, 2), 'i_sum': (0x30, 1, 2),
+                      'p': (0x34, 1, None), 's': (0x38, 1, None), 'q': (0x3C, 1, None), 'pf': (0x3E, 1, 3),
+                      'phi': (0x42, 1, 1), 'f': (0x46, 1, 2),
+                      'e_import': (0x48, 1000, None), 'e_export': (0x4A, 1000, None),
+                      'eq_import': (0x4C, 1000, None), 'eq_export': (0x4E, 1000, None),
+                      'es_total': (0x50, 1000, None), 'ah_total': (0x52, 1, 2),
+                      'p_demand': (0x54, 1, None), 'p_demand_max': (0x56, 1, None),
+                      's_demand': (0x64, 1, None), 's_demand_max': (0x66, 1, None),
+                      'i_n_demand': (0x68, 1, 2), 'i_n_demand_max': (0x6A, 1, 2),
+                      'u12': (0xC8, 1, 1), 'u23': (0xCA, 1, 1), 'u31': (0xCC, 1, 1), 'u_ll': (0xCE, 1, 1),
+                      'i_n': (0xE0, 1, 2),
+                      'thd_u1': (0xEA, 1, 1), 'thd_u2': (0xEC, 1, 1), 'thd_u3': (0xEE, 1, 1),
+                      'thd_i1': (0xF0, 1, 1), 'thd_i2': (0xF2, 1, 1), 'thd_i3': (0xF4, 1, 1),
+                      'thd_u': (0xF8, 1, 1), 'thd_i': (0xFA, 1, 1),
+                      'i1_demand': (0x102, 1, 2), 'i2_demand': (0x104, 1, 2), 'i3_demand': (0x106, 1, 2),
+                      'i1_demand_max': (0x108, 1, 2), 'i2_demand_max': (0x10A, 1, 2), 'i3_demand_max': (0x10C, 1, 2),
+                      'e_total': (0x156, 1000, None), 'eq_total': (0x158, 1000, None),
+                      'e1_import': (0x15A, 1000, None), 'e2_import': (0x15C, 1000, None),
+                      'e3_import': (0x15E, 1000, None), 'e1_export': (0x160, 1000, None),
+                      'e2_export': (0x162, 1000, None), 'e3_export': (0x164, 1000, None),
+                      'e1_total': (0x166, 1000, None), 'e2_total': (0x168, 1000, None),
+                      'e3_total': (0x16A, 1000, None)}}
+
+    def __init__(self, port, type, address, lifetime=10, log_name='sdmx', max_gap=60, max_registers=80):
         """
         Init for a Device
 
@@ -31,11 +94,18 @@ class SDM:
         :param type:    'SDM120', 'SDM72' or 'SDM630'
         :param address:  Deviceaddress as integer
         :param lifetime: Number of get cycles that may fail and data remains valid
+        :param max_gap: Maximum number of unused registers read between two keys of a block
+        :param max_registers: Maximum number of registers of a block (Eastron limit: 80)
         """
         self.port = port
         self.type = type
         self.address = address
         self.lifetime = lifetime
+        self.max_gap = max_gap
+        self.max_registers = max_registers
+        self.plans = {}  # cache, tuple with keys: list with blocks
+        self.bus = Bus.get(port)  # arbiter shared by all meters on the port
+        self.breaker = Breaker(log_name=log_name)  # skip transactions while the meter is offline
         self.log = logging.getLogger(log_name)
         self.log.debug('init type={} port={}'.format(type, port))
         self.data = None  # Data
@@ -45,11 +115,11 @@ class SDM:
         """
         Read the requested keys (registers) from the device.
 
-        SDM120 @9600Baud , 'p', 'e_import', 'e_export' = ~0.200ms
+        SDM120 @9600Baud , 'p', 'e_import', 'e_export' = one transaction, block 0x0C..0x4B
 
         :param keys: Registers to read
         :param timeout: total time in seconds for the complete cycle
-        :return: Dictionary with result of this read
+        :return: Dictionary with result of this read, None for the keys of failed blocks
         """
 
         t0 = time.perf_counter()
@@ -57,36 +127,30 @@ class SDM:
         error = None
         data = {k: None for k in keys}  # init all requested keys with None
 
-        # ====== open port ======
-        bus = None
-        while time.perf_counter() < time_timeout:
-            try:
-                # port name, slave address (in decimal)
-                bus = minimalmodbus.Instrument(self.port, self.address, close_port_after_each_call=True)
-                bus.serial.baudrate = 9600
-                bus.serial.timeout = 0.1
-                break
-            except Exception as e:
-                error = "{}".format(e)
-                time.sleep(0.1)
-
         # ====== read data ======
 
-        for k in keys:
-            while time.perf_counter() < time_timeout:
-                try:
-                    data[k] = round(bus.read_float(self.cfg[self.type][k][0], 4) * self.cfg[self.type][k][1])
-                    break
-                except Exception as e:
-                    if not error:
-                        error = "{}".format(e)
-                    time.sleep(0.01)
-
-        if time.perf_counter() < time_timeout:  # valid data received
+        blocks = []
+        if self.breaker.allow():
+            blocks = [(items, self.bus.submit(self.address, start, count, priority=min(p for k, o, f, d, p in items),
+                                              deadline=time_timeout)) for start, count, items in self.plan(keys)]
+        else:
+            error = "circuit breaker open"
+        for items, transaction in blocks:
+            raw = transaction.wait(time_timeout - time.perf_counter())  # register data as bytes
+            if raw is None:
+                if not error:
+                    error = transaction.error or "timeout"
+                continue
+            for k, offset, factor, digits, priority in items:
+                data[k] = round(struct.unpack_from('>f', raw, offset * 2)[0] * factor, digits)
+
+        if not error:  # valid data received
             self.lifetime_timeout = t0 + self.lifetime if self.lifetime else None  # set new lifetime timeout
-            self.data = data
+            self.data = {**self.data, **data} if self.data else data  # keep keys read with a longer interval
+            self.breaker.success()
             self.log.debug("read done in {:.3f}s data: {}".format(time.perf_counter() - t0, data))
         else:
+            self.breaker.failure()
             self.log.debug("read failed {:.3f}s error: {}".format(time.perf_counter() - t0, error))
             if self.lifetime:
                 if self.lifetime_timeout and time.perf_counter() > self.lifetime_timeout:
@@ -95,8 +159,41 @@ class SDM:
                     self.data = None  # clear data
             else:
                 self.data = None  # without lifetime set self.data instantly to read result
+            received = {k: v for k, v in data.items() if v is not None}
+            if received:  # keep the blocks which succeeded
+                self.data = {**self.data, **received} if self.data else received
         return data
 
+    def plan(self, keys):
+        """
+        Merge the keys to as few blocks of contiguous registers as possible. Two keys are read with the same
+        block if the unused registers between them do not exceed max_gap and the block does not exceed max_registers.
+        @9600Baud an unused register costs ~2ms, an additional transaction ~20ms plus the response time of the meter.
+
+        Energy counters (keys starting with 'e' or 'ah') get priority 1, all other keys priority 0.
+
+        plan(['p', 'e_import']) --> [(0x0C, 62, [('p', 0, 1, None, 0), ('e_import', 60, 1000, None, 1)])]
+
+        :param keys: list with keys
+        :return: list with blocks (start register, number of registers,
+                                   [(key, register offset, factor, digits, priority), ...])
+        """
+        plan = self.plans.get(tuple(keys))
+        if plan is None:
+            plan = []
+            for k in sorted(keys, key=lambda k: self.cfg[self.type][k][0]):
+                register, factor, digits = self.cfg[self.type][k]
+                priority = 1 if k.startswith(('e', 'ah')) else 0
+                if plan:
+                    start, count, items = plan[-1]
+                    if register - (start + count) <= self.max_gap and register + 2 - start <= self.max_registers:
+                        items.append((k, register - start, factor, digits, priority))
+                        plan[-1] = (start, max(count, register + 2 - start), items)
+                        continue
+                plan.append((register, 2, [(k, 0, factor, digits, priority)]))
+            self.plans[tuple(keys)] = plan
+        return plan
+
     def get(self, key, default=None):
         """
         Get a value from data.
@@ -5,6 +5,10 @@ import logging
 import threading
 import time
 import requests
+try:
+    from device.breaker import Breaker
+except:
+    from breaker import Breaker
 
 
 class Symo:
@@ -23,6 +27,7 @@ class Symo:
         self.data = None
         self.lifetime_timeout = time.perf_counter() + self.lifetime if self.lifetime else None  # set lifetime timeout
         self.thread_sleep = None  # sleep between two gets in thread mode
+        self.breaker = Breaker(log_name=log_name)  # skip requests while the inverter is offline (e.g. at night)
         self.log.debug("init address: {}".format(ip_address))
 
     def read(self):
@@ -38,6 +43,7 @@ class Symo:
         url = url_template.format(self.ip_address)
         data = None
         try:
+            self.breaker.check()  # raises BreakerOpen while the inverter is offline
             r = requests.get(url, timeout=self.timeout)
             if r.status_code == 200:
                 val = json.loads(r.content)
@@ -48,10 +54,12 @@ class Symo:
                 }
                 self.lifetime_timeout = t0 + self.lifetime if self.lifetime else None  # set new lifetime timeout
                 self.data = data
+                self.breaker.success()
                 self.log.debug("read done in {:.3f}s data: {}".format(time.perf_counter() - t0, data))
             else:
                 raise ValueError("status_code={} url={}".format(r.status_code, url))
         except Exception as e:
+            self.breaker.failure()
             self.log.debug("read failed {:.3f}s error: {}".format(time.perf_counter() - t0, e))
             if self.lifetime:
                 if self.lifetime_timeout and time.perf_counter() > self.lifetime_timeout:
@@ -5,6 +5,10 @@ import json
 import logging
 import requests
 import time
+try:
+    from device.breaker import Breaker
+except:
+    from breaker import Breaker
 """
 
 http://192.168.0.25/api/set?psm=1    3 --> 1
@@ -28,6 +32,7 @@ class GoeApiV2:
         self.lifetime = lifetime
         self.data = None
         self.lifetime_timeout = time.perf_counter() + self.lifetime if self.lifetime else None  # set lifetime timeout
+        self.breaker = Breaker(log_name=log_name)  # skip requests while the wallbox is offline
         self.log.debug("init address: {}".format(ip_address))
 
     def read(self):
@@ -40,6 +45,7 @@ class GoeApiV2:
         url = url_template.format(self.ip_address)
         d = None
         try:
+            self.breaker.check()  # raises BreakerOpen while the wallbox is offline
             resp = requests.get(url, timeout=self.timeout)
             if resp.status_code == 200:
                 r = json.loads(resp.content)
@@ -95,11 +101,13 @@ class GoeApiV2:
 
                 self.lifetime_timeout = t0 + self.lifetime if self.lifetime else None  # set new lifetime timeout
                 self.data = d
+                self.breaker.success()
                 self.log.debug("read done in {:.3f}s data: {}".format(time.perf_counter() - t0, d))
             else:
                 raise ValueError("failed with status_code={}".format(resp.status_code))
 
         except Exception as e:
+            self.breaker.failure()
             self.log.debug("read failed {:.3f}s error: {}".format(time.perf_counter() - t0, e))
             if self.lifetime:
                 if self.lifetime_timeout and time.perf_counter() > self.lifetime_timeout:
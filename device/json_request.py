@@ -4,6 +4,10 @@ import json
 import logging
 import time
 import requests
+try:
+    from device.breaker import Breaker
+except:
+    from breaker import Breaker
 
 
 class JsonRequest:
@@ -12,7 +16,7 @@ class JsonRequest:
 
     Sends an HTTP request. The response (JSON) is converted to a dictionary.
     With Lifetime a timeout for data can be specified. Even if there is an error or no read, data is still valid for
-    the specified period.
+    the specified period. An offline device is skipped by a circuit breaker and probed periodically.
     """
 
     def __init__(self, url, timeout=1, lifetime=10, log_name='api'):
@@ -28,6 +32,7 @@ class JsonRequest:
         self.log = logging.getLogger(log_name)
         self.data = None  # Data
         self.lifetime_timeout = time.perf_counter() + self.lifetime if self.lifetime else None  # set lifetime timeout
+        self.breaker = Breaker(log_name=log_name)  # skip requests while the device is offline
         self.log.debug("init url: {}".format(url))
 
     def read(self, post=None):
@@ -39,6 +44,7 @@ class JsonRequest:
         t0 = time.perf_counter()
         data = None
         try:
+            self.breaker.check()  # raises BreakerOpen while the device is offline
             if post is None:
                 r = requests.get(self.url, timeout=self.timeout)
             else:
@@ -50,9 +56,11 @@ class JsonRequest:
 
             self.lifetime_timeout = t0 + self.lifetime if self.lifetime else None  # set new lifetime timeout
             self.data = data
+            self.breaker.success()
             self.log.debug("read done in {:.3f}s data: {}".format(time.perf_counter() - t0, data))
 
         except Exception as e:
+            self.breaker.failure()
             self.log.debug("read failed {:.3f}s error: {}".format(time.perf_counter() - t0, e))
             if self.lifetime:
                 if self.lifetime_timeout and time.perf_counter() > self.lifetime_timeout:
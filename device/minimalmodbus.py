@@ -1497,6 +1497,142 @@ class Instrument:
 
         return answer
 
+    # ############################################ #
+    # Fast path for precompiled Modbus RTU frames  #
+    # ############################################ #
+
+    def precompile_read_registers(
+        self, registeraddress: int, number_of_registers: int, functioncode: int = 3
+    ) -> "PrecompiledRequest":
+        """Validate and build a register read request once, for repeated use.
+
+        The request is built as bytes including slave address and CRC. Use it
+        with :meth:`read_precompiled`. Only Modbus RTU is supported.
+
+        Args:
+            * registeraddress: The slave register start address (use decimal
+              numbers, not hex).
+            * number_of_registers: The number of registers to read, max 125 registers.
+            * functioncode: Modbus function code. Can be 3 or 4.
+
+        Returns:
+            A :class:`PrecompiledRequest` for the current slave address.
+
+        Raises:
+            TypeError, ValueError
+
+        New in MeterHub.
+        """
+        _check_functioncode(functioncode, [3, 4])
+        _check_registeraddress(registeraddress)
+        _check_int(
+            number_of_registers,
+            minvalue=1,
+            maxvalue=_MAX_NUMBER_OF_REGISTERS_TO_READ,
+            description="number of registers",
+        )
+        self._check_precompile()
+        return PrecompiledRequest(
+            self.address, functioncode, registeraddress, number_of_registers
+        )
+
+    def precompile_write_registers(
+        self, registeraddress: int, number_of_registers: int
+    ) -> "PrecompiledRequest":
+        """Validate and build the header of a register write request (function code 16) once.
+
+        Use it with :meth:`write_precompiled`. Only Modbus RTU is supported.
+
+        Args:
+            * registeraddress: The slave register start address (use decimal
+              numbers, not hex).
+            * number_of_registers: The number of registers to write, max 123 registers.
+
+        Returns:
+            A :class:`PrecompiledRequest` for the current slave address.
+
+        Raises:
+            TypeError, ValueError
+
+        New in MeterHub.
+        """
+        _check_registeraddress(registeraddress)
+        _check_int(
+            number_of_registers,
+            minvalue=1,
+            maxvalue=_MAX_NUMBER_OF_REGISTERS_TO_WRITE,
+            description="number of registers",
+        )
+        self._check_precompile()
+        return PrecompiledRequest(
+            self.address, 16, registeraddress, number_of_registers
+        )
+
+    def read_precompiled(self, request: "PrecompiledRequest") -> memoryview:
+        """Read registers with a precompiled request.
+
+        The arguments are not validated again, the response is checked for
+        CRC, slave address, function code and length only.
+
+        Args:
+            * request: From :meth:`precompile_read_registers`.
+
+        Returns:
+            The register data as big endian bytes (2 bytes per register),
+            without copy of the response.
+
+        Raises:
+            ModbusException, serial.SerialException (inherited from IOError)
+
+        New in MeterHub.
+        """
+        response = self._communicate(request.frame, request.response_size)
+        return _check_response_bytes(response, request)
+
+    def write_precompiled(
+        self, request: "PrecompiledRequest", values: Union[bytes, List[int]]
+    ) -> None:
+        """Write registers with a precompiled request (function code 16).
+
+        Args:
+            * request: From :meth:`precompile_write_registers`.
+            * values: Register data as big endian bytes (2 bytes per register)
+              or a list of int (0..65535). The length must fit to the request.
+
+        Raises:
+            ValueError, ModbusException,
+            serial.SerialException (inherited from IOError)
+
+        New in MeterHub.
+        """
+        if not isinstance(values, (bytes, bytearray, memoryview)):
+            values = struct.pack(">{}H".format(len(values)), *values)
+        if len(values) != request.number_of_registers * _NUMBER_OF_BYTES_PER_REGISTER:
+            raise ValueError(
+                "The data length does not match number of registers. "
+                + "Bytes: {0!r}, Number of registers: {1!r}.".format(
+                    len(values), request.number_of_registers
+                )
+            )
+        frame = request.frame + bytes(values)
+        frame += struct.pack("<H", _calculate_crc_bytes(frame))
+        response = self._communicate(frame, request.response_size)
+        if bytes(_check_response_bytes(response, request)) != request.frame[2:6]:
+            raise InvalidResponseError(
+                "Wrong echo of register address and number of registers. "
+                + "Response: {!r}".format(response)
+            )
+
+    def _check_precompile(self) -> None:
+        """Check that the instrument settings allow precompiled requests."""
+        if self.mode != MODE_RTU:
+            raise ValueError(
+                "Precompiled requests are only supported for Modbus RTU. "
+                + "Given mode: {!r}.".format(self.mode)
+            )
+        if self.address == _SLAVEADDRESS_BROADCAST:
+            raise ValueError("Precompiled requests can not be used for broadcast.")
+
 
 # ########## #
 # Exceptions #
@@ -1545,6 +1681,127 @@ class InvalidResponseError(MasterReportedException):
     """The response does not fulfill the Modbus standad, for example wrong checksum."""
 
 
+# ############################ #
+# Precompiled Modbus RTU frame #
+# ############################ #
+
+
+class PrecompiledRequest:
+    """Modbus RTU request, validated and built once as bytes.
+
+    For function codes 3 and 4 the frame is complete including the CRC. For
+    function code 16 the frame is the header up to the byte count, the
+    register data and CRC are added for each call.
+
+    Use :meth:`Instrument.precompile_read_registers` or
+    :meth:`Instrument.precompile_write_registers` to create it.
+
+    New in MeterHub.
+    """
+
+    __slots__ = (
+        "slaveaddress",
+        "functioncode",
+        "registeraddress",
+        "number_of_registers",
+        "frame",
+        "response_size",
+    )
+
+    def __init__(
+        self,
+        slaveaddress: int,
+        functioncode: int,
+        registeraddress: int,
+        number_of_registers: int,
+    ) -> None:
+        self.slaveaddress = slaveaddress
+        self.functioncode = functioncode
+        self.registeraddress = registeraddress
+        self.number_of_registers = number_of_registers
+        if functioncode == 16:
+            self.frame = struct.pack(
+                ">BBHHB",
+                slaveaddress,
+                functioncode,
+                registeraddress,
+                number_of_registers,
+                number_of_registers * _NUMBER_OF_BYTES_PER_REGISTER,
+            )
+            self.response_size = 8  # Address, functioncode, register, number, CRC
+        else:
+            frame = struct.pack(
+                ">BBHH",
+                slaveaddress,
+                functioncode,
+                registeraddress,
+                number_of_registers,
+            )
+            self.frame = frame + struct.pack("<H", _calculate_crc_bytes(frame))
+            self.response_size = (
+                5 + number_of_registers * _NUMBER_OF_BYTES_PER_REGISTER
+            )  # Address, functioncode, bytecount, data, CRC
+
+    def __repr__(self) -> str:
+        """Give string representation of the :class:`.PrecompiledRequest` object."""
+        return "{}.{}<address={}, functioncode={}, registeraddress={}, number_of_registers={}>".format(
+            self.__module__,
+            self.__class__.__name__,
+            self.slaveaddress,
+            self.functioncode,
+            self.registeraddress,
+            self.number_of_registers,
+        )
+
+
+def _check_response_bytes(response: bytes, request: PrecompiledRequest) -> memoryview:
+    """Check a Modbus RTU response to a precompiled request.
+
+    Args:
+        * response: Raw response from the slave, including CRC.
+        * request: The precompiled request.
+
+    Returns:
+        The payload without slave address, function code, byte count (for
+        function code 3 and 4) and CRC, as memoryview of the response.
+
+    Raises:
+        SlaveReportedException or subclass, InvalidResponseError
+
+    """
+    if len(response) < 5:
+        raise InvalidResponseError(
+            "Too short Modbus RTU response (minimum length 5 bytes). "
+            + "Response: {!r}".format(response)
+        )
+    if _calculate_crc_bytes(response):  # CRC over data and CRC is 0
+        raise InvalidResponseError(
+            "CRC error in response: {}".format(_describe_bytes(response))
+        )
+    if response[_BYTEPOSITION_FOR_SLAVEADDRESS] != request.slaveaddress:
+        raise InvalidResponseError(
+            "Wrong return slave address: {} instead of {}. Response: {!r}".format(
+                response[_BYTEPOSITION_FOR_SLAVEADDRESS], request.slaveaddress, response
+            )
+        )
+    if response[_BYTEPOSITION_FOR_FUNCTIONCODE] != request.functioncode:
+        _check_response_slaveerrorcode(str(response[:3], encoding="latin1"))
+        raise InvalidResponseError(
+            "Wrong functioncode: {} instead of {}. Response: {!r}".format(
+                response[_BYTEPOSITION_FOR_FUNCTIONCODE], request.functioncode, response
+            )
+        )
+    if len(response) != request.response_size:
+        raise InvalidResponseError(
+            "Wrong response length: {} instead of {} bytes. Response: {!r}".format(
+                len(response), request.response_size, response
+            )
+        )
+    if request.functioncode == 16:
+        return memoryview(response)[2:-2]
+    return memoryview(response)[3:-2]
+
+
 # ################ #
 # Payload handling #
 # ################ #
@@ -3288,6 +3545,24 @@ def _calculate_crc_string(inputstring: str) -> str:
     return _num_to_twobyte_string(register, lsb_first=True)
 
 
+def _calculate_crc_bytes(inputbytes: Union[bytes, bytearray, memoryview]) -> int:
+    """Calculate CRC-16 for Modbus from bytes, without validation.
+
+    Args:
+        inputbytes: An arbitrary-length message (without the CRC), or a
+        message including its CRC to check it (result 0).
+
+    Returns:
+        The CRC as int, to be sent least significant byte first.
+
+    """
+    register = 0xFFFF
+    table = _CRC16TABLE
+    for byte in inputbytes:
+        register = (register >> 8) ^ table[(register ^ byte) & 0xFF]
+    return register
+
+
 def _calculate_lrc_string(inputstring: str) -> str:
     """Calculate LRC for Modbus.
 
@@ -0,0 +1,245 @@
+# RS485 Bus Arbiter for Modbus RTU devices
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+try:
+    from device import minimalmodbus
+except:
+    import minimalmodbus
+
+
+class Transaction:
+    """
+    Single queued Modbus transaction. The result is available with wait().
+    """
+
+    def __init__(self, address, start, count, functioncode, priority, deadline):
+        self.address = address
+        self.start = start
+        self.count = count
+        self.functioncode = functioncode
+        self.priority = priority
+        self.deadline = deadline  # time.perf_counter(), the transaction fails if not done until then
+        self.result = None  # register data, big endian bytes (memoryview)
+        self.error = None  # error message of the latest try
+        self.retries = 0  # number of retries so far
+        self.event = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the transaction.
+
+        :param timeout: timeout in seconds
+        :return: register data as big endian bytes (memoryview) or None
+        """
+        self.event.wait(timeout if timeout is None else max(timeout, 0))
+        return self.result
+
+
+class Bus:
+    """
+    RS485 Bus Arbiter
+
+    A bus owns a serial port with a long-lived Modbus session (one minimalmodbus.Instrument, the slave address is
+    switched per transaction). Transactions of all devices on the port are queued and served by a single worker in
+    priority order (0 first), equal priorities in order of submission. The Modbus silent period is enforced once for
+    the bus by the single session. A failed transaction is retried once (retries) behind all fresh transactions, an
+    offline device does not block the bus for the healthy ones. Request frames are precompiled once and read with the
+    bytes based fast path of minimalmodbus.
+
+    bus = Bus.get('/dev/ttyUSB0')
+    t = bus.submit(address=2, start=0x0C, count=2, priority=0, deadline=time.perf_counter() + 1)
+    registers = t.wait(1)
+    """
+
+    buses = {}  # port: Bus, one arbiter per port
+    retry_priority = 1000  # priority of a retry, served after all fresh transactions
+    buses_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, port, baudrate=9600):
+        """
+        Get the arbiter of a port, created on first use.
+
+        :param port: '/dev/ttyUSB0' or 'COM6', ...
+        :param baudrate: baudrate of the bus
+        :return: Bus
+        """
+        with cls.buses_lock:
+            if port not in cls.buses:
+                cls.buses[port] = Bus(port, baudrate=baudrate)
+            return cls.buses[port]
+
+    def __init__(self, port, baudrate=9600, timeout=0.1, retries=1, log_name='rs485'):
+        """
+        :param port: '/dev/ttyUSB0' or 'COM6', ...
+        :param baudrate: baudrate of the bus
+        :param timeout: response timeout of a single transaction in seconds, the transmission time of the response
+                        is added for every request
+        :param retries: number of retries of a failed transaction (within its deadline)
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.retries = retries
+        self.log = logging.getLogger(log_name)
+        self.instrument = None  # long-lived session, None if closed
+        self.requests = {}  # (address, functioncode, start, count): minimalmodbus.PrecompiledRequest
+        self.queue = []  # heap with (priority, sequence, transaction)
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.busy_time = 0  # time the bus was occupied since latest load()
+        self.busy_since = None  # start of the active transaction, or latest load() during it
+        self.t_load = time.perf_counter()
+        self.counter = {'transactions': 0, 'errors': 0, 'open': 0, 'open_time': 0, 'reset': 0, 'reset_time': 0}
+        threading.Thread(target=self.worker, daemon=True).start()
+        self.log.debug("init port: {}".format(port))
+
+    def submit(self, address, start, count, functioncode=4, priority=1, deadline=None):
+        """
+        Queue a register read.
+
+        :param address: slave address
+        :param start: start register
+        :param count: number of registers
+        :param functioncode: 3 or 4
+        :param priority: 0 for control relevant values, higher numbers are served later
+        :param deadline: time.perf_counter() until the transaction has to be done, None for 1 second
+        :return: Transaction
+        """
+        deadline = time.perf_counter() + 1 if deadline is None else deadline
+        transaction = Transaction(address, start, count, functioncode, priority, deadline)
+        with self.condition:
+            heapq.heappush(self.queue, (priority, next(self.sequence), transaction))
+            self.condition.notify()
+        return transaction
+
+    def worker(self):
+        """
+        Endless loop, serve queued transactions in priority order.
+        """
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                priority, sequence, transaction = heapq.heappop(self.queue)
+
+            if time.perf_counter() >= transaction.deadline:
+                if transaction.error is None:
+                    transaction.error = "deadline passed before transaction"
+                transaction.event.set()
+                continue
+
+            with self.condition:
+                self.busy_since = time.perf_counter()
+            try:
+                transaction.result = self.transact(transaction)
+                transaction.event.set()
+            except minimalmodbus.ModbusException as e:  # no or invalid response, port remains open
+                transaction.error = "{}".format(e)
+                self.reset()
+                self.retry(transaction)
+            except Exception as e:  # port failure, reopen with next try
+                transaction.error = "{}".format(e)
+                self.close()
+                time.sleep(0.1)
+                self.retry(transaction)
+            with self.condition:
+                self.busy_time += time.perf_counter() - self.busy_since
+                self.busy_since = None
+
+    def transact(self, transaction):
+        """
+        Execute a single transaction with the long-lived session.
+
+        :return: register data, big endian bytes (memoryview)
+        """
+        if self.instrument is None:
+            t0 = time.perf_counter()
+            self.instrument = minimalmodbus.Instrument(self.port, transaction.address, close_port_after_each_call=False)
+            self.instrument.serial.baudrate = self.baudrate
+            self.instrument.serial.timeout = self.timeout
+            self.instrument.clear_buffers_before_each_transaction = False  # buffers are only reset after an error
+            self.count('open', time.perf_counter() - t0)
+            self.log.debug("open port {} in {:.3f}s".format(self.port, time.perf_counter() - t0))
+        key = (transaction.address, transaction.functioncode, transaction.start, transaction.count)
+        request = self.requests.get(key)
+        if request is None:  # validate and build the frame only once
+            self.instrument.address = transaction.address
+            request = self.requests[key] = self.instrument.precompile_read_registers(
+                transaction.start, transaction.count, functioncode=transaction.functioncode)
+        timeout = self.timeout + request.response_size * 11 / self.baudrate  # 80 registers take 0.17s at 9600 Baud
+        if self.instrument.serial.timeout != timeout:
+            self.instrument.serial.timeout = timeout
+        self.counter['transactions'] += 1
+        return self.instrument.read_precompiled(request)
+
+    def retry(self, transaction):
+        """
+        Queue a failed transaction again behind all fresh transactions, or finish it if there are no retries left.
+        """
+        self.counter['errors'] += 1
+        if transaction.retries >= self.retries:
+            transaction.event.set()  # failed, result None
+            return
+        transaction.retries += 1
+        with self.condition:
+            heapq.heappush(self.queue, (self.retry_priority + transaction.priority, next(self.sequence), transaction))
+
+    def reset(self):
+        """
+        Discard pending bytes (e.g. a late response) after an error.
+        """
+        try:
+            t0 = time.perf_counter()
+            self.instrument.serial.reset_input_buffer()
+            self.instrument.serial.reset_output_buffer()
+            self.count('reset', time.perf_counter() - t0)
+        except:
+            pass
+
+    def close(self):
+        """
+        Close the session, the next transaction opens a new one.
+        """
+        try:
+            self.instrument.serial.close()
+        except:
+            pass
+        self.instrument = None
+
+    def count(self, name, t):
+        """
+        Count a port operation and its time for the statistics.
+        """
+        self.counter[name] += 1
+        self.counter[name + '_time'] += t
+
+    def load(self, period=None):
+        """
+        Bus utilisation since the previous call. Called once per cycle, this is the utilisation of the cycle. An active
+        transaction is split, the time until now counts for this call, the rest for the next one.
+
+        :param period: cycle time in seconds, None for the time since the previous call
+        :return: utilisation in percent (0..100)
+        """
+        t = time.perf_counter()
+        with self.condition:
+            busy, self.busy_time = self.busy_time, 0
+            if self.busy_since is not None:
+                busy += t - self.busy_since
+                self.busy_since = t
+        elapsed, self.t_load = t - self.t_load, t
+        period = elapsed if period is None else period
+        return min(round(100 * busy / period, 1), 100.0) if period > 0 else None
+
+    def stats(self):
+        """
+        Get bus statistics
+
+        :return: Dictionary
+        """
+        return {**{k: round(v, 4) for k, v in self.counter.items()}, 'queue': len(self.queue)}
@@ -25,13 +25,20 @@ http://192.168.0.10:8008/command/goe?amp=8 --> WALLBOX/api/set?amp=8
 
 import json
 import logging
+import math
 import os
 import threading
 import time
 from datetime import datetime
 from logging.handlers import TimedRotatingFileHandler
-from bottle import Bottle, request, response
+from bottle import Bottle, default_app, request, response
 from utils.backup import backup
+from utils.binary import BinaryEncoder
+from utils.scheduler import Scheduler
+from utils.shared import SharedExport
+from utils.snapshot import Snapshot, parse_cursor
+from utils.store import Store
+from utils.stream import Stream
 from utils.trace import trace
 import config
 from app import App
@@ -45,35 +52,46 @@ class MeterHub:
         self.app = App()
 
         self.data = None  # primary dataset
-        self.publish_data = {}  # storage for publised data from the devices   "key" :{"value": 99, "timeout": 3412341 }
-        self.t_minute = 0  # timer for minute interval
+        self.snapshot = None  # JSON encoded dataset of the latest cycle, served by the webserver
+        self.seq = 0  # cycle sequence number
+        self.binary = BinaryEncoder(enums={'car_state': ('idle', 'charge', 'wait', 'complete', 'error')})  # /bin
+        self.cycle = threading.Condition()  # notifies waiting requests (long-poll) about a new snapshot
+        stream_port = getattr(config, 'stream_port', 8009)
+        self.stream = Stream(port=stream_port).start() if stream_port else None  # Server-Sent Events, /stream
+        shared_export = getattr(config, 'shared_export', None)
+        self.shared = SharedExport(shared_export) if shared_export else None  # shared memory for local consumers
+        self.publish_data = Store(self.app.publish_config)  # published data from the devices
+        self.publish_valid = set()  # valid published keys of the latest cycle, for the timeout log
+        self.scheduler = Scheduler(period=getattr(config, 'cycle_time', 1))  # main loop with fixed deadlines
+        trace.max_size = getattr(config, 'trace_max_size', trace.max_size)  # limit of /trace/<size>
 
         self.web = Bottle()  # webserver
         self.web.route('/', callback=self.web_data_request, method=('POST', 'GET'))
+        self.web.route('/next', callback=self.web_next)
+        self.web.route('/bin', callback=self.web_binary)
+        self.web.route('/bin/schema', callback=self.web_binary_schema)
         self.web.route('/version', callback=lambda: {'name': self.name, 'version': self.version})
+        self.web.route('/status', callback=self.web_status)
         self.web.route('/command/<target>', callback=self.web_command)
+        self.web.route('/command/<target>/<id:int>', callback=self.web_command_status)
         self.web.route('/log', callback=self.web_log)  # access to logfile
+        self.web.merge([r for r in default_app().routes if r.rule.startswith('/trace')])  # routes of the trace module
 
         logging.getLogger('waitress.queue').setLevel(logging.ERROR)  # hide waitress info log
-        # start webserver thread
+        # start webserver thread, long-poll requests hold a thread until the next cycle
         threading.Thread(target=self.web.run, daemon=True,
-                         kwargs=dict(host='0.0.0.0', port=config.webserver_port, server='waitress')).start()
+                         kwargs=dict(host='0.0.0.0', port=config.webserver_port, server='waitress',
+                                     threads=getattr(config, 'webserver_threads', 16))).start()
 
     def start(self):
         self.log.info('start {} {}'.format(self.name, self.version))
         while True:
-            t0 = time.perf_counter()  # store start time
+            t0 = self.scheduler.wait()  # sleep until next tick, start time of this cycle
             data = {}
             data['time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             data['timestamp'] = int(datetime.utcnow().timestamp())
 
-            if t0 > self.t_minute:  # flag every minute     # ToDo: universal interval
-                self.t_minute = t0 + 60
-                minute_flag = True
-            else:
-                minute_flag = False
-
-            self.app.work(data, minute=minute_flag)  # aquire data
+            self.app.work(data, t0)  # aquire data, with the deadline as time base for the poll intervals
 
             self.publish_process(data)
 
@@ -83,61 +101,173 @@ class MeterHub:
             trace.push(data)  # save dataset to trace module
             backup.push(data)  # save 5min Dataset to local Backup (additional to FTP)
 
+            snapshot = Snapshot(data, self.seq + 1, self.binary)  # encode once for all requests of this cycle
+            with self.cycle:
+                self.seq = snapshot.seq  # together with the snapshot, /next waits for the following one
+                self.snapshot = snapshot
+                self.cycle.notify_all()  # release long-poll requests
+            if self.stream:
+                self.stream.publish(snapshot)  # push to SSE subscribers
+            if self.shared:
+                self.shared.write(snapshot)  # latest dataset for local processes
             self.data = data  # accessable by webserver
 
-            while time.perf_counter() < t0 + 1:
-                time.sleep(0.01)
-
     def web_data_request(self):
         """
-        Process data access. If request includes POST Data. They will be stored in self.publish_data
+        Process data access. If request includes POST Data. They will be stored in self.publish_data (all keys of a
+        POST are applied together).
+        With /?wait=<timestamp> the request is held until a dataset newer than the timestamp is available (long-poll).
 
-        Returns: Dictionary with dataset
+        Returns: dataset (JSON)
         """
         try:
             post = json.loads(request.body.read())
             self.log.debug("publish post received: {}".format(post))
-            for k, timeout in self.app.publish_config:
-                if k in post:  # publish key found in post
-                    self.publish_data[k] = {'value': post[k], 'timeout': time.perf_counter() + timeout}
-                    self.log.debug("publish key={} data={}".format(k, self.publish_data[k]))
+            keys = self.publish_data.publish(post)  # only keys enabled in publish_config
+            self.log.debug("publish keys={}".format(keys))
         except:
             pass
 
-        if self.data is None:
+        return self.web_cursor()
+
+    def web_binary(self):
+        """
+        /bin    Dataset as packed struct, the layout is described by /bin/schema. Supports ETag and long-poll (?wait=).
+
+        Returns: bytes
+        """
+        return self.web_cursor(binary=True)
+
+    def web_binary_schema(self):
+        """
+        /bin/schema     Schema descriptor of /bin, reload if the schema id in the payload changes
+
+        Returns: JSON
+        """
+        snapshot = self.snapshot
+        if snapshot is None:
             response.status = 404
-        return self.data
+            return None
+        response.content_type = 'application/json'
+        return snapshot.schema
+
+    def web_cursor(self, binary=False):
+        """
+        Serve the snapshot, with /?wait=<timestamp> the request is held until a newer dataset is available.
+        """
+        cursor = request.query.get('wait')
+        if cursor:
+            try:
+                parse_cursor(cursor)  # validate, also before the first snapshot
+            except ValueError:
+                response.status = 400
+                return "invalid wait={}, use a timestamp or ETag".format(cursor)
+            return self.web_wait(lambda snapshot: snapshot.newer(cursor), binary)
+        return self.web_snapshot(binary)
+
+    def web_next(self):
+        """
+        /next   Hold the request until the next cycle (long-poll)
+
+        Returns: dataset (JSON)
+        """
+        with self.cycle:
+            seq = self.seq  # sequence number of the published snapshot
+        return self.web_wait(lambda snapshot: snapshot.seq > seq)
+
+    def web_wait(self, newer, binary=False):
+        """
+        Wait for a new snapshot, server side timeout with /?timeout=<seconds> (default 10s, maximum 60s).
+
+        :param newer: function(snapshot), True if the snapshot is new for the client
+        :param binary: True for /bin
+        Returns: dataset (JSON) or 304 after timeout
+        """
+        try:
+            timeout = float(request.query.get('timeout', 10))
+        except ValueError:
+            timeout = 10
+        if not math.isfinite(timeout):
+            timeout = 10  # nan or inf would wait forever and block a webserver thread
+        timeout = min(max(timeout, 0), 60)
+        with self.cycle:
+            ready = self.cycle.wait_for(lambda: self.snapshot is not None and newer(self.snapshot), timeout)
+        if not ready:
+            response.status = 304  # no new dataset, poll again
+            return b''
+        return self.web_snapshot(binary)
 
     def web_command(self, target=None):
         """
-        Handle commands: /command/<target>
+        Handle commands: /command/<target>, the command is queued and executed in background. The id of the command is
+        returned in the header X-Command-Id.
 
-        Returns: Dictionary with dataset
+        Returns: dataset (JSON)
         """
-        if target in self.app.command:
-            self.app.command[target] = request.query_string
-            self.log.debug("web_command target={} command={}".format(target, request.query_string))
+        id = self.app.command.submit(target, request.query_string)  # only enabled targets, None if not allowed
+        if id is not None:
+            response.set_header('X-Command-Id', str(id))  # status with /command/<target>/<id>
+            self.log.debug("web_command target={} command={} id={}".format(target, request.query_string, id))
         else:
             self.log.debug("web_command target={} not allowed".format(target))
 
-        if self.data is None:
+        return self.web_snapshot()
+
+    def web_command_status(self, target, id):
+        """
+        /command/<target>/<id>   Status of a command: queued, running, done, failed, superseded or ignored
+
+        Returns: Dictionary
+        """
+        command = self.app.command.get(id)
+        if command is None or command['target'] != target:
+            response.status = 404
+            return {'id': id, 'status': 'unknown'}
+        return command
+
+    def web_snapshot(self, binary=False):
+        """
+        Serve the dataset snapshot of the latest cycle. Returns 304 for GET requests with a matching If-None-Match.
+        With /?keys=grid_p,pv_p only the given keys are returned.
+
+        :param binary: True for the packed struct (/bin)
+        Returns: JSON or packed struct (bytes)
+        """
+        snapshot = self.snapshot
+        if snapshot is None:
             response.status = 404
-        return self.data
+            return None
+        response.set_header('ETag', snapshot.etag)
+        response.set_header('Cache-Control', 'no-cache')
+        if request.method == 'GET' and snapshot.match(request.get_header('If-None-Match')):
+            response.status = 304
+            return b''
+        if binary:
+            response.content_type = 'application/octet-stream'
+            return snapshot.binary
+        response.content_type = 'application/json'
+        keys = request.query.get('keys')
+        return snapshot.project(keys) if keys else snapshot.body
 
     def publish_process(self, data):
         """
         Copy received publish data from devices to main dataset.
         """
-        if self.app.publish_config:
-            for k, timeout in self.app.publish_config:
-                try:
-                    # remove old data
-                    if time.perf_counter() > self.publish_data[k]['timeout']:  # clean with timeout timer
-                        del (self.publish_data[k])
-                        self.log.info("publish timeout: {}".format(k))
-                except:
-                    pass
-                data[k] = self.publish_data.get(k, {}).get('value', None)  # copy from publish to data
+        values = self.publish_data.view()  # consistent version, without expired values
+        for k in self.publish_valid.difference(values):
+            self.log.info("publish timeout: {}".format(k))
+        self.publish_valid = set(values)
+        for k, timeout in self.app.publish_config:
+            data[k] = values.get(k, None)  # copy from publish to data
+
+    def web_status(self):
+        """
+        /status    Runtime statistics of the main loop
+
+        Returns: Dictionary
+        """
+        return {'scheduler': self.scheduler.stats(), 'stream': self.stream.stats() if self.stream else None,
+                **self.app.status()}
 
     def web_log(self):
         """
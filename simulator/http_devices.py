@@ -0,0 +1,229 @@
+"""
+HTTP Device Simulator
+
+Local stand-ins for the HTTP devices, every device on its own port of 127.0.0.1:
+
+Fronius     /solar_api/v1/GetInverterRealtimeData.cgi, two inverters (Symo)
+GoE         /api/status and /api/set (GoeApiV2)
+Water       /json, AI-on-the-edge water meter (JsonRequest)
+
+Latency, jitter, timeouts (no response) and errors (HTTP 500) are configurable for every device, the profile 'wifi'
+imitates the weak WiFi of the wallbox and the slow inverter.
+
+python3 -m simulator.http_devices [lan|wifi]     # load test of the drivers, then keep the devices running
+"""
+
+import logging
+import math
+import random
+import sys
+import threading
+import time
+from bottle import Bottle, request, abort
+
+profiles = {  # name: {device: (latency, jitter, timeout_rate, error_rate)}
+    'lan': {'fronius': (0.05, 0.05, 0, 0), 'goe': (0.01, 0.02, 0, 0), 'water': (0.02, 0.02, 0, 0)},
+    'wifi': {'fronius': (1.5, 2.5, 0.02, 0.01), 'goe': (0.05, 0.4, 0.05, 0.02), 'water': (0.2, 0.5, 0.05, 0.02)}
+}
+
+
+class HttpDevice:
+    """
+    Webserver with a simulated device. Every request is delayed by latency plus a random jitter. With timeout_rate a
+    request is not answered within `hang` seconds (client timeout), with error_rate it fails with HTTP 500.
+    """
+
+    def __init__(self, port, latency=0.0, jitter=0.0, timeout_rate=0.0, error_rate=0.0, hang=10, log_name='sim_http'):
+        """
+        :param port: TCP port on 127.0.0.1
+        :param latency: minimum response time in seconds
+        :param jitter: maximum additional random response time in seconds
+        :param timeout_rate: part of requests without response (0..1)
+        :param error_rate: part of requests with HTTP 500 (0..1)
+        :param hang: time in seconds a request without response is held
+        """
+        self.log = logging.getLogger(log_name)
+        self.port = port
+        self.address = '127.0.0.1:{}'.format(port)
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout_rate = timeout_rate
+        self.error_rate = error_rate
+        self.hang = hang
+        self.counter = {'requests': 0, 'timeouts': 0, 'errors': 0}
+        self.web = Bottle()
+
+    def route(self, path, callback):
+        """
+        Add a route with the simulated network behaviour.
+        """
+        def weak(*args, **kwargs):
+            self.counter['requests'] += 1
+            r = random.random()
+            if r < self.timeout_rate:
+                self.counter['timeouts'] += 1
+                time.sleep(self.hang)
+                abort(504)
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+            if r < self.timeout_rate + self.error_rate:
+                self.counter['errors'] += 1
+                abort(500)
+            return callback(*args, **kwargs)
+
+        self.web.route(path, callback=weak)
+
+    def start(self):
+        threading.Thread(target=self.web.run, daemon=True,
+                         kwargs=dict(host='127.0.0.1', port=self.port, server='waitress', quiet=True,
+                                     threads=16)).start()
+        self.log.info("http device on {}".format(self.address))
+        return self
+
+
+class Fronius(HttpDevice):
+    """
+    Fronius Symo Solar API with two inverters, driver: Symo(fronius.address)
+    """
+
+    def __init__(self, port=8101, **kwargs):
+        super().__init__(port, log_name='sim_fronius', **kwargs)
+        self.e_total = [9472610.0, 665262.0]  # Wh
+        self.e_day = [0.0, 0.0]
+        self.t = time.perf_counter()
+        self.route('/solar_api/v1/GetInverterRealtimeData.cgi', self.realtime_data)
+
+    def realtime_data(self):
+        t = time.perf_counter()
+        p = [round(max(0.0, 4500 * math.sin(t / 120) + random.uniform(-30, 30))), 0]
+        p[1] = round(p[0] * 0.7)
+        for i in range(2):
+            self.e_total[i] += p[i] * (t - self.t) / 3600
+            self.e_day[i] += p[i] * (t - self.t) / 3600
+        self.t = t
+        values = lambda v: {str(i + 1): round(v[i]) for i in range(2)}
+        return {'Body': {'Data': {'DAY_ENERGY': {'Unit': 'Wh', 'Values': values(self.e_day)},
+                                  'PAC': {'Unit': 'W', 'Values': values(p)},
+                                  'TOTAL_ENERGY': {'Unit': 'Wh', 'Values': values(self.e_total)},
+                                  'YEAR_ENERGY': {'Unit': 'Wh', 'Values': values(self.e_day)}}},
+                'Head': {'RequestArguments': {'DataCollection': request.query.get('DataCollection', ''),
+                                              'Scope': request.query.get('Scope', '')},
+                         'Status': {'Code': 0, 'Reason': '', 'UserMessage': ''},
+                         'Timestamp': time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime())}}
+
+
+class GoE(HttpDevice):
+    """
+    go-e Charger API v2, driver: GoeApiV2(goe.address). Settings with /api/set are applied to the status.
+    """
+
+    def __init__(self, port=8102, **kwargs):
+        super().__init__(port, log_name='sim_goe', **kwargs)
+        self.status = {'amp': 6, 'frc': 1, 'fsp': False, 'eto': 1436000, 'car': 1, 'wh': 0.0}
+        self.t = time.perf_counter()
+        self.route('/api/status', self.api_status)
+        self.route('/api/set', self.api_set)
+
+    def api_status(self):
+        t = time.perf_counter()
+        charge = self.status['frc'] != 1
+        self.status['car'] = 2 if charge else 1
+        p = self.status['amp'] * (1 if self.status['fsp'] else 3) * 230 if charge else 0
+        self.status['wh'] += p * (t - self.t) / 3600
+        self.status['eto'] += round(p * (t - self.t) / 3600)
+        self.t = t
+        self.status['nrg'] = [230, 230, 230, 0, 0, 0, 0, 0, 0, 0, 0, p, 100, 100, 100, 100]
+        keys = request.query.get('filter')
+        return {k: v for k, v in self.status.items() if not keys or k in keys.split(',')}
+
+    def api_set(self):
+        result = {}
+        for key, value in request.query.items():
+            if key == 'amp' and 6 <= int(value) <= 16:
+                self.status['amp'] = int(value)
+            elif key == 'frc' and value in ('0', '1', '2'):
+                self.status['frc'] = int(value)
+            elif key == 'psm' and value in ('1', '2'):
+                self.status['fsp'] = value == '1'
+            else:
+                abort(400, 'invalid {}={}'.format(key, value))
+            result[key] = True
+        return result
+
+
+class Water(HttpDevice):
+    """
+    AI-on-the-edge water meter, driver: JsonRequest(water.url)
+    """
+
+    def __init__(self, port=8103, **kwargs):
+        super().__init__(port, log_name='sim_water', **kwargs)
+        self.url = 'http://{}/json'.format(self.address)
+        self.value = 1367154  # liter
+        self.route('/json', self.json)
+
+    def json(self):
+        self.value += random.choice((0, 0, 0, 1, 5))
+        return {'main': {'value': self.value, 'raw': '{:08d}'.format(self.value), 'pre': self.value,
+                         'error': 'no error', 'rate': '0.0',
+                         'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')}}
+
+
+def start(profile='lan'):
+    """
+    Start all HTTP devices
+
+    :param profile: 'lan' or 'wifi'
+    :return: Dictionary {name: HttpDevice}
+    """
+    behaviour = {name: dict(zip(('latency', 'jitter', 'timeout_rate', 'error_rate'), values))
+                 for name, values in profiles[profile].items()}
+    return {'fronius': Fronius(**behaviour['fronius']).start(),
+            'goe': GoE(**behaviour['goe']).start(),
+            'water': Water(**behaviour['water']).start()}
+
+
+def load(devices, cycles=60, period=1.0):
+    """
+    Load test of the HTTP drivers with the acquisition setup of App, measures read times and cycle overruns.
+    """
+    from device.fronius import Symo
+    from device.goe_api_v2 import GoeApiV2
+    from device.json_request import JsonRequest
+    from utils.acquisition import Acquisition
+    from utils.scheduler import Scheduler
+
+    pv = Symo(devices['fronius'].address, log_name='fronius')
+    goe = GoeApiV2(devices['goe'].address, log_name='goe', lifetime=30)
+    water = JsonRequest(devices['water'].url, lifetime=10 * 60 + 10, log_name='water')
+    acquisition = Acquisition()
+    acquisition.add('goe', goe.read, interval=1)
+    acquisition.add('pv', pv.read, interval=2, wait=False)
+    acquisition.add('water', water.read, interval=5)
+    scheduler = Scheduler(period=period)
+
+    timing = []
+    for i in range(cycles):
+        t0 = scheduler.wait()
+        timing.append(acquisition.run(t0))
+        if i == cycles // 2:
+            goe.set('frc=0&amp=10')
+    for name in timing[0]:
+        values = [d[name] for d in timing if d[name] is not None]
+        if values:
+            print("{:<6} n={:<3} min={:.3f}s avg={:.3f}s max={:.3f}s".format(
+                name, len(values), min(values), sum(values) / len(values), max(values)))
+    print("scheduler: {}".format(scheduler.stats()))
+    for name, device in devices.items():
+        print("{:<8} {}".format(name, device.counter))
+    print("data: pv={} goe={} water={}".format(pv.data, goe.data, water.get(('main', 'value'))))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)-10s %(levelname)-6s %(message)s')
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+
+    devices = start(sys.argv[1] if len(sys.argv) > 1 else 'lan')
+    time.sleep(0.5)  # webserver startup
+    load(devices)
+    while True:  # keep devices running for MeterHub (config.py: fronius_symo_address, goe_wallbox_address, ...)
+        time.sleep(1)
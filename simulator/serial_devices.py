@@ -0,0 +1,271 @@
+"""
+Serial Device Simulator
+
+Virtual serial ports (pty) with simulated meters, to run and benchmark MeterHub without the RS485 adapter and the
+IR coupler:
+
+SdmBus      RS485 bus with Eastron SDM120/SDM72/SDM630 Modbus RTU slaves, realistic timing at 9600 Baud
+SmlMeter    SML meter (ISKRA MT175 or EMH eHZ) pushing a frame every 1-4 seconds, paced at 9600 Baud
+
+python3 -m simulator.serial_devices     # run standalone, ports linked to /tmp/meterhub_sdm and /tmp/meterhub_sml
+"""
+
+import logging
+import math
+import os
+import random
+import struct
+import threading
+import time
+import tty
+from device.eastron import SDM
+from device.minimalmodbus import _calculate_crc_bytes
+from device.sml import Sml
+
+
+class VirtualPort:
+    """
+    Pseudo terminal pair, the simulated device uses the master side, the application opens `port`. A device class
+    implements run() with its loop on the master side.
+    """
+
+    def __init__(self, baudrate=9600, link=None, log_name='sim'):
+        """
+        :param baudrate: simulated baudrate, used for the transmission timing (8N1, 10 bits per byte)
+        :param link: optional path of a symbolic link to the port, e.g. '/tmp/meterhub_sdm'
+        """
+        self.log = logging.getLogger(log_name)
+        self.baudrate = baudrate
+        self.master, slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(slave)
+        self.slave = slave  # keep open, the port stays valid while the application reopens it
+        self.port = os.ttyname(slave)
+        if link:
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(self.port, link)
+            self.port = link
+        self.log.info("virtual port {}".format(self.port))
+
+    def byte_time(self, n):
+        """
+        Transmission time in seconds for n bytes
+        """
+        return n * 10 / self.baudrate
+
+    def start(self):
+        """
+        Start run() of the device in a background thread
+        """
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+
+class SdmBus(VirtualPort):
+    """
+    RS485 bus with Eastron SDM Modbus RTU slaves. Function codes 3 and 4, float registers as defined in SDM.cfg.
+    Requests to addresses without a slave are not answered (timeout).
+    """
+
+    def __init__(self, meters=None, response_delay=0.02, baudrate=9600, link=None):
+        """
+        :param meters: Dictionary {address: type}, default {1: 'SDM630', 2: 'SDM120', 3: 'SDM72'}
+        :param response_delay: processing time of the meter in seconds, between request and response
+        """
+        super().__init__(baudrate=baudrate, link=link, log_name='sim_sdm')
+        self.meters = {1: 'SDM630', 2: 'SDM120', 3: 'SDM72'} if meters is None else meters
+        self.response_delay = response_delay
+        self.energy = {address: 1000.0 * address for address in self.meters}  # kWh
+        self.t_energy = {address: time.perf_counter() for address in self.meters}  # time of the last energy update
+        self.requests = 0
+
+    def values(self, address):
+        """
+        Simulated register image of a meter.
+
+        :return: Dictionary {register: float}
+        """
+        t = time.perf_counter()
+        p = 1500 + 1200 * math.sin(t / 30 + address) + random.uniform(-20, 20)  # W
+        self.energy[address] += p * (t - self.t_energy[address]) / 3600000  # kWh
+        self.t_energy[address] = t
+        values = {}
+        for key, (register, factor, digits) in SDM.cfg[self.meters[address]].items():
+            if key.startswith(('e', 'ah')):
+                value = self.energy[address]
+            elif key.startswith('u'):
+                value = 230 + random.uniform(-2, 2)
+            elif key.startswith('i'):
+                value = p / 3 / 230
+            elif key.startswith(('p', 's', 'q')) and not key.startswith('pf'):
+                value = p if key in ('p', 's', 'q') or key.startswith('p_') else p / 3
+            elif key.startswith('pf'):
+                value = 0.95
+            elif key.startswith('phi'):
+                value = 18.2
+            elif key == 'f':
+                value = 50 + random.uniform(-0.05, 0.05)
+            else:
+                value = 3.0
+            values[register] = value
+        return values
+
+    def response(self, request):
+        """
+        Build the response for a request frame, None if there is no slave for the address.
+        """
+        address, functioncode, start, count = struct.unpack('>BBHH', request[:6])
+        if address not in self.meters:
+            return None
+        if functioncode not in (3, 4):
+            frame = struct.pack('>BBB', address, functioncode | 0x80, 1)  # illegal function
+        else:
+            values = self.values(address)
+            data = bytearray(count * 2)
+            for register, value in values.items():
+                if start <= register and register + 2 <= start + count:
+                    struct.pack_into('>f', data, (register - start) * 2, value)
+            frame = struct.pack('>BBB', address, functioncode, count * 2) + bytes(data)
+        return frame + struct.pack('<H', _calculate_crc_bytes(frame))
+
+    def run(self):
+        buffer = b''
+        while True:
+            buffer += os.read(self.master, 256)
+            while len(buffer) >= 8:
+                if _calculate_crc_bytes(buffer[:8]):  # no valid request, resync
+                    buffer = buffer[1:]
+                    continue
+                request, buffer = buffer[:8], buffer[8:]
+                self.requests += 1
+                time.sleep(self.byte_time(len(request)) + self.response_delay)  # receive and process
+                response = self.response(request)
+                if response:
+                    time.sleep(self.byte_time(len(response)))  # transmit
+                    os.write(self.master, response)
+
+
+class SmlMeter(VirtualPort):
+    """
+    SML meter (IR interface), pushes a frame every 1-4 seconds. The frame is written paced at the baudrate, so the
+    application receives partial frames as with a real IR coupler.
+    """
+
+    def __init__(self, variant='MT175', interval=(1, 4), baudrate=9600, link=None):
+        """
+        :param variant: 'MT175' (ISKRA) or 'eHZ' (EMH, 5 byte energy and power without sign)
+        :param interval: (min, max) time between two frames in seconds
+        """
+        super().__init__(baudrate=baudrate, link=link, log_name='sim_sml')
+        self.variant = variant
+        self.interval = interval
+        self.e_import = 4539537.0  # Wh
+        self.e_export = 30636590.0  # Wh
+        self.frames = 0
+
+    def run(self):
+        t = time.perf_counter()
+        while True:
+            p = round(800 * math.sin(time.perf_counter() / 60) + random.uniform(-50, 50))
+            dt = random.uniform(*self.interval)
+            frame = sml_frame(self.e_import, self.e_export, p, variant=self.variant)
+            for i in range(0, len(frame), 32):
+                chunk = frame[i:i + 32]
+                time.sleep(self.byte_time(len(chunk)))
+                os.write(self.master, chunk)
+            self.frames += 1
+            if p > 0:
+                self.e_import += p * dt / 3600
+            else:
+                self.e_export -= p * dt / 3600
+            t += dt
+            time.sleep(max(t - time.perf_counter(), 0))
+
+
+def sml_message(body, transaction):
+    """
+    SML message with transaction id and message CRC
+    """
+    message = b'\x76\x05' + struct.pack('>I', transaction) + b'\x62\x00\x62\x00' + body
+    return message + b'\x63' + struct.pack('>H', Sml().calc_crc(message + b'\x63')) + b'\x00'
+
+
+def sml_frame(e_import, e_export, p, variant='MT175', transaction=0x1234):
+    """
+    Build a SML frame (OpenResponse, GetListResponse, CloseResponse) as sent by the meter.
+
+    :param e_import: energy import in Wh
+    :param e_export: energy export in Wh
+    :param p: power in W, positive for import
+    :param variant: 'MT175' or 'eHZ'
+    :return: bytes
+    """
+    server_id = b'\x0b\x0a\x01\x49\x53\x4b\x00\x04\x6e\x3c\x1f'
+    entries = [b'\x77\x07\x81\x81\xc7\x82\x03\xff\x01\x01\x01\x01\x04\x49\x53\x4b\x01',  # manufacturer
+               b'\x77\x07\x01\x00\x00\x00\x09\xff\x01\x01\x01\x01' + server_id + b'\x01']  # server id
+    if variant == 'eHZ':  # 5 byte energy, status with direction flag, absolute power
+        status = b'\x64\x01\x01\xa2' if p < 0 else b'\x64\x01\x01\x82'
+        entries += [b'\x77\x07\x01\x00\x01\x08\x00\xff' + status + b'\x01\x62\x1e\x52\xff\x56' +
+                    struct.pack('>q', round(e_import * 10))[3:] + b'\x01',
+                    b'\x77\x07\x01\x00\x02\x08\x00\xff\x01\x01\x62\x1e\x52\xff\x56' +
+                    struct.pack('>q', round(e_export * 10))[3:] + b'\x01',
+                    b'\x77\x07\x01\x00\x0f\x07\x00\xff\x01\x01\x62\x1b\x52\x00\x55' + struct.pack('>i', abs(p)) + b'\x01']
+    else:
+        entries += [b'\x77\x07\x01\x00\x01\x08\x00\xff\x65\x00\x00\x01\x82\x01\x62\x1e\x52\xff\x59' +
+                    struct.pack('>q', round(e_import * 10)) + b'\x01',
+                    b'\x77\x07\x01\x00\x02\x08\x00\xff\x01\x01\x62\x1e\x52\xff\x59' +
+                    struct.pack('>q', round(e_export * 10)) + b'\x01',
+                    b'\x77\x07\x01\x00\x10\x07\x00\xff\x01\x01\x62\x1b\x52\x00\x55' + struct.pack('>i', p) + b'\x01']
+
+    open_response = b'\x72\x63\x01\x01\x76\x01\x01\x05' + struct.pack('>I', transaction) + server_id + b'\x01\x01'
+    list_response = (b'\x72\x63\x07\x01\x77\x01' + server_id + b'\x07\x01\x00\x62\x0a\xff\xff\x72\x62\x01\x65' +
+                     struct.pack('>I', transaction) + bytes([0x70 + len(entries)]) + b''.join(entries) + b'\x01\x01')
+    close_response = b'\x72\x63\x02\x01\x71\x01'
+
+    body = (b'\x1b\x1b\x1b\x1b\x01\x01\x01\x01' + sml_message(open_response, transaction) +
+            sml_message(list_response, transaction + 1) + sml_message(close_response, transaction + 2))
+    padding = (4 - len(body) % 4) % 4
+    frame = body + b'\x00' * padding + b'\x1b\x1b\x1b\x1b\x1a' + bytes([padding])
+    return frame + struct.pack('<H', Sml().calc_crc(frame))
+
+
+def latency(sdm_port, sml_port, cycles=20):
+    """
+    Measure read latency of the SDM meters (via acquisition, as in App.work) and the SML decoder.
+    """
+    from utils.acquisition import Acquisition
+
+    sml = Sml(port=sml_port, log_name='mt175')
+    sdm630 = SDM(sdm_port, type="SDM630", address=1, log_name='sdm630')
+    sdm120 = SDM(sdm_port, type="SDM120", address=2, log_name='sdm120')
+    sdm72 = SDM(sdm_port, type="SDM72", address=3, log_name='sdm72')
+    acquisition = Acquisition()
+    acquisition.add('sdm120', sdm120.read, keys={'p': 1, 'e_import': 30, 'e_export': 30})
+    acquisition.add('sdm630', sdm630.read, keys={'p': 1, 'e_total': 30, 'u1': 1, 'i1': 1, 'pf1': 1, 'f': 1})
+    acquisition.add('sdm72', sdm72.read, keys={'p': 1, 'e_total': 30})
+    acquisition.add('sml', sml.read, transport=sml_port)
+
+    timing = []
+    t = time.perf_counter()
+    for i in range(cycles):
+        t0 = time.perf_counter()
+        timing.append(acquisition.run(t))
+        timing[-1]['cycle'] = round(time.perf_counter() - t0, 3)
+        t += 1
+        time.sleep(max(t - time.perf_counter(), 0))
+    for name in timing[0]:
+        values = [d[name] for d in timing if d[name] is not None]
+        print("{:<8} min={:.3f}s avg={:.3f}s max={:.3f}s".format(name, min(values), sum(values) / len(values),
+                                                                 max(values)))
+    print("sml data: {}  sdm630 data: {}".format(sml.data, sdm630.data))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)-10s %(levelname)-6s %(message)s')
+
+    sdm_bus = SdmBus(link='/tmp/meterhub_sdm').start()
+    sml_meter = SmlMeter(link='/tmp/meterhub_sml').start()
+    latency(sdm_bus.port, sml_meter.port)
+    while True:  # keep ports alive for MeterHub (config.py: eastron_sdm_port / sml_ir_port)
+        time.sleep(1)
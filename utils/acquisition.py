@@ -0,0 +1,144 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class Acquisition:
+    """
+    Acquisition engine for MeterHub
+
+    Device reads are registered as jobs. Jobs which share a transport (e.g. a serial port) are executed one after
+    another by the same worker, independent transports (serial ports, HTTP devices) are read in parallel.
+    The time for a complete acquisition is given by the slowest transport instead of the sum of all devices.
+
+    Every job, or every key of a job, has its own poll interval. A run only executes the jobs and keys which are due,
+    jobs with keys are called with the list of due keys. A key which is not read (None in the returned dictionary or
+    exception) is due again in the next run instead of after its interval. Slow devices can run in background (wait=False), the run does
+    not wait for them and a job still busy from a previous run is not started again.
+
+    acquisition.add('sdm120', sdm120.read, transport='/dev/ttyUSB0', keys={'p': 1, 'e_import': 30})
+    acquisition.add('goe', goe.read)  # without transport, the job gets its own worker
+    acquisition.add('water', water.read, interval=60)
+    acquisition.run()  # --> {'sdm120': 0.102, 'goe': 0.231, 'water': None}  read time in seconds
+    """
+
+    def __init__(self, log_name='acquisition'):
+        self.log = logging.getLogger(log_name)
+        self.jobs = {}  # name: {'transport': .., 'function': .., 'keys': .., 'interval': .., 'wait': ..}
+        self.due_time = {}  # (name, key): time the key is due again, key is None for jobs without keys
+        self.timing = {}  # read time in seconds of the latest execution for every job
+        self.finished = {}  # name: read time of a background job completed since the previous run
+        self.busy = {}  # name: future of a running background job
+        self.executor = None  # thread pool, one worker for each transport and background job
+
+    def add(self, name, function, transport=None, interval=0, keys=None, wait=True):
+        """
+        Add a read job
+
+        :param name: name of the job, used for timing
+        :param function: function without arguments, or with a list of due keys if keys are given, returning a
+                         dictionary with the values (None if not read)
+        :param transport: jobs with the same transport are executed sequential, None for an independent job
+        :param interval: poll interval in seconds, 0 for every run
+        :param keys: Dictionary with a poll interval for every key, e.g. {'p': 1, 'e_total': 30}
+        :param wait: False to run the job in background, e.g. for devices slower than a cycle
+        """
+        self.jobs[name] = {'transport': name if transport is None else transport,
+                           'function': function,
+                           'keys': keys is not None,
+                           'interval': dict(keys) if keys is not None else {None: interval},
+                           'wait': wait}
+        self.timing[name] = None
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        self.executor = None  # rebuild executor with the new number of workers
+
+    def plan(self, t):
+        """
+        Get jobs and keys which are due at time t.
+
+        :param t: time in seconds (time.perf_counter)
+        :return: Dictionary {name: list with due keys or None for jobs without keys}
+        """
+        plan = {}
+        for name, job in self.jobs.items():
+            if not job['wait'] and name in self.busy and not self.busy[name].done():
+                continue  # background job from previous run still active, remains due
+            due = [k for k, interval in job['interval'].items()
+                   if t >= self.due_time.get((name, k), t) - 0.001]  # tolerance for float deadlines
+            if due:
+                plan[name] = due if job['keys'] else None
+        return plan
+
+    def run(self, t=None):
+        """
+        Execute due jobs and wait until all transports are finished.
+
+        :param t: time of the run (time.perf_counter), e.g. the deadline from the scheduler. None for now.
+        :return: Dictionary with read time for every job in seconds, None if not executed in this run.
+                 For background jobs the read time if an execution has completed since the previous run, else None.
+        """
+        t = time.perf_counter() if t is None else t
+        plan = self.plan(t)
+
+        if self.executor is None:
+            workers = set(job['transport'] if job['wait'] else name for name, job in self.jobs.items())
+            self.executor = ThreadPoolExecutor(max_workers=max(len(workers), 1), thread_name_prefix='acquisition')
+
+        groups = {}  # transport: [(name, function, keys), ...]
+        for name, keys in plan.items():
+            job = self.jobs[name]
+            for k in (keys or [None]):
+                self.due_time[(name, k)] = t + job['interval'][k]
+            if job['wait']:
+                self.timing[name] = None
+                groups.setdefault(job['transport'], []).append((name, job['function'], keys))
+            else:
+                self.busy[name] = self.executor.submit(self.work, [(name, job['function'], keys)])
+
+        wait([self.executor.submit(self.work, jobs) for jobs in groups.values()])
+        return {name: (self.timing[name] if name in plan else None) if job['wait'] else self.finished.pop(name, None)
+                for name, job in self.jobs.items()}
+
+    def work(self, jobs):
+        """
+        Worker for a single transport, execute jobs one after another.
+
+        :param jobs: list with (name, function, keys)
+        """
+        for name, function, keys in jobs:
+            t0 = time.perf_counter()
+            try:
+                if keys is None:
+                    function()
+                else:
+                    result = function(keys)
+                    if isinstance(result, dict):
+                        for k in keys:
+                            if result.get(k) is None:
+                                self.due_time.pop((name, k), None)  # not read, due again in the next run
+            except Exception as e:
+                self.log.error("{} exception: {}".format(name, e))
+                for k in keys or []:
+                    self.due_time.pop((name, k), None)
+            self.timing[name] = round(time.perf_counter() - t0, 3)
+            if not self.jobs[name]['wait']:
+                self.finished[name] = self.timing[name]  # reported once by the next run
+
+
+if __name__ == "__main__":
+    """
+    Simple Test for acquisition module, three slow devices on two transports
+    """
+    logging.basicConfig(level=logging.DEBUG)
+
+    acquisition = Acquisition()
+    acquisition.add('a', lambda keys: time.sleep(0.1 * len(keys)), transport='/dev/ttyUSB0', keys={'p': 0, 'e': 3})
+    acquisition.add('f', lambda keys: {'p': 1, 'e': None}, keys={'p': 2, 'e': 3})  # 'e' fails, due every run
+    acquisition.add('b', lambda: time.sleep(0.2), transport='/dev/ttyUSB0')
+    acquisition.add('c', lambda: time.sleep(0.4), interval=2)
+    acquisition.add('d', lambda: time.sleep(1.5), interval=1, wait=False)
+    for i in range(5):
+        t0 = time.perf_counter()
+        print(acquisition.plan(t0), acquisition.run(t0), "total={:.3f}s".format(time.perf_counter() - t0))
+        time.sleep(max(0.0, t0 + 1 - time.perf_counter()))
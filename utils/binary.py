@@ -0,0 +1,209 @@
+import json
+import math
+import struct
+import zlib
+
+nulls = {'b': -128, 'B': 255, 'i': -2 ** 31, 'q': -2 ** 63, 'f': math.nan, 'd': math.nan}  # null values per type
+
+
+class BinaryEncoder:
+    """
+    Binary encoding of the dataset for MeterHub (/bin)
+
+    The dataset is packed with a fixed schema to a little endian struct, a few hundred bytes instead of the JSON and
+    decoded with a single unpack. Field order and types are derived from the dataset produced by App.work:
+
+    b   bool            int8    null -128
+    B   string (enum)   uint8   null 255, index in the enum list of the schema
+    i   int             int32   null -2147483648
+    q   int (large)     int64   null -9223372036854775808
+    f   float           float32 null NaN
+    d   int and float   float64 null NaN
+
+    Keys with other values (lists, dictionaries) and 'time' (same as 'timestamp') are not encoded. Keys without a
+    value so far are float32 until the first value. The schema is extended if a new key, a new enum string or a
+    value which does not fit to the type appears. Every payload starts with the id of its schema (crc32) and the
+    sequence number, a client reloads the schema (/bin/schema) if the id changes.
+
+    encoder = BinaryEncoder()
+    payload = encoder.encode(data, seq)  -->  b'\\x9c\\x1f\\x03\\x5a\\x2a\\x00\\x00\\x00...'
+    encoder.schema  -->  b'{"id":1510154140,"format":"<IIii...","size":176,"fields":[...]}'
+    """
+
+    header = [{'key': 'schema', 'type': 'I', 'offset': 0}, {'key': 'seq', 'type': 'I', 'offset': 4}]
+
+    def __init__(self, skip=('time',), enums=None):
+        """
+        :param skip: keys not encoded
+        :param enums: known strings of keys, e.g. {'car_state': ['idle', 'charge']}, avoids schema changes at runtime
+        """
+        self.skip = set(skip)
+        self.keys = None  # keys of the latest dataset, the schema is checked if they change
+        self.fields = {}  # key: [type, enum dictionary {string: index} or None, provisional]
+        self.enums = {key: {v: i for i, v in enumerate(values)} for key, values in (enums or {}).items()}
+        self.struct = None
+        self.id = 0
+        self.schema = b''  # schema descriptor (JSON)
+
+    def encode(self, data, seq=0):
+        """
+        Encode a dataset
+
+        :param data: dataset (dictionary)
+        :param seq: sequence number of the cycle
+        :return: bytes
+        """
+        keys = tuple(data)
+        if keys != self.keys:
+            self.keys = keys
+            self.update(data)
+        try:
+            return self.pack(data, seq)
+        except (struct.error, KeyError):  # value does not fit to the schema
+            self.update(data)
+            return self.pack(data, seq, strict=False)
+
+    def pack(self, data, seq, strict=True):
+        """
+        :param strict: raise KeyError or struct.error for a value which does not fit, else encode it as null
+        """
+        values = [self.id, seq]
+        for key, (typ, enum, provisional) in self.fields.items():
+            value = data.get(key)
+            if value is None:
+                values.append(nulls[typ])
+            elif enum is not None:
+                if not isinstance(value, str):
+                    values.append(nulls[typ])  # not encodable, e.g. a dictionary (unhashable)
+                    continue
+                index = enum.get(value)
+                if index is None:
+                    if strict:
+                        raise KeyError(key)  # new string
+                    index = nulls[typ]
+                values.append(index)
+            elif strict:
+                if provisional:
+                    raise KeyError(key)  # first value, type unknown so far
+                values.append(value)
+            else:
+                t = kind(value)
+                values.append(value if t is not None and merge(typ, t) == typ else nulls[typ])
+        return self.struct.pack(*values)
+
+    def update(self, data):
+        """
+        Extend the schema to a dataset, existing fields keep their position.
+        """
+        for key, value in data.items():
+            if key in self.skip:
+                continue
+            typ = kind(value)
+            if typ is None and value is not None:
+                continue  # not encodable
+            field = self.fields.get(key)
+            if field is None:
+                if key in self.enums:
+                    field = self.fields[key] = ['B', dict(self.enums[key]), False]
+                else:
+                    field = self.fields[key] = ['f', None, True] if value is None else [typ, None, False]
+            elif value is None:
+                continue
+            elif field[2]:  # first value
+                field[:] = [typ, None, False]
+            elif field[0] != typ:
+                field[0] = merge(field[0], typ)
+            if field[0] == 'B':
+                if field[1] is None:
+                    field[1] = {}
+                if isinstance(value, str) and value not in field[1] and len(field[1]) < 254:
+                    field[1][value] = len(field[1])
+        self.build()
+
+    def build(self):
+        fields = []
+        offset = 8
+        for key, (typ, enum, provisional) in self.fields.items():
+            field = {'key': key, 'type': typ, 'offset': offset, 'null': None if typ in 'fd' else nulls[typ]}
+            if enum is not None:
+                field['enum'] = list(enum)
+            fields.append(field)
+            offset += struct.calcsize('<' + typ)
+        fmt = '<II' + ''.join(typ for typ, enum, provisional in self.fields.values())
+        self.id = zlib.crc32(json.dumps([fmt, fields]).encode())
+        self.struct = struct.Struct(fmt)
+        self.schema = json.dumps({'id': self.id, 'format': fmt, 'size': self.struct.size,
+                                  'header': self.header, 'fields': fields}, separators=(',', ':')).encode()
+
+
+def kind(value):
+    """
+    Type of a value
+
+    :return: type character or None if not encodable
+    """
+    if isinstance(value, bool):
+        return 'b'
+    if isinstance(value, int):
+        return 'i' if -2 ** 31 < value < 2 ** 31 else 'q'
+    if isinstance(value, float):
+        return 'f'
+    if isinstance(value, str):
+        return 'B'
+    return None
+
+
+def merge(a, b):
+    """
+    Common type of two types
+    """
+    if a == b:
+        return a
+    types = {a, b}
+    if types <= {'b', 'i'}:
+        return 'i'
+    if types <= {'b', 'i', 'q'}:
+        return 'q'
+    if types <= {'b', 'i', 'q', 'f', 'd'}:
+        return 'd'
+    return 'B' if 'B' in types else 'd'  # string and number, numbers are null
+
+
+def decode(schema, payload):
+    """
+    Decode a payload with its schema descriptor (reference for clients)
+
+    :param schema: schema descriptor (dictionary from /bin/schema)
+    :param payload: bytes from /bin
+    :return: dataset (dictionary)
+    """
+    values = struct.unpack(schema['format'], payload)
+    if values[0] != schema['id']:
+        raise ValueError("schema id {} does not match, reload /bin/schema".format(values[0]))
+    data = {'seq': values[1]}
+    for field, value in zip(schema['fields'], values[2:]):
+        if value == field['null'] or value != value:  # null or NaN
+            value = None
+        elif 'enum' in field:
+            value = field['enum'][value]
+        elif field['type'] == 'b':
+            value = bool(value)
+        elif field['type'] == 'f':
+            value = float('{:.7g}'.format(value))  # float32 to shortest decimal
+        data[field['key']] = value
+    return data
+
+
+if __name__ == "__main__":
+    """
+    Simple Test for binary module
+    """
+    encoder = BinaryEncoder()
+    data = {'time': '2022-09-25 00:05:57', 'timestamp': 1664049957, 'grid_p': None, 'home_pf1': 0.826,
+            'grid_imp_eto': 4539537, 'car_stop': True, 'car_state': 'complete', 'bat_info': {'x': 1}}
+    for i, change in enumerate(({}, {'grid_p': 304}, {'car_state': 'charge'}, {'grid_p': 3e9}, {'car_stop': 'x'}, {},
+                                {'car_state': {'x': 1}}, {'car_state': [1]}, {'car_state': 5})):
+        data.update(change)
+        payload = encoder.encode(data, i)
+        print(len(payload), encoder.id, decode(json.loads(encoder.schema), payload))
+    print(encoder.schema)
@@ -0,0 +1,151 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+
+class CommandQueue:
+    """
+    Asynchronous command queue for MeterHub
+
+    Commands for a target (/command/<target>?amp=8) are queued and executed by a worker thread of the target, the
+    main loop is never blocked by a slow device. Commands which are waiting are coalesced by parameter, the latest
+    value wins: 'amp=6&frc=0' followed by 'amp=8' is executed once as 'amp=8&frc=0'. A command whose parameters are
+    all replaced by later commands before execution is superseded.
+
+    Every command gets an id with a status: queued, running, done, failed, superseded or ignored (no parameters).
+
+    command = CommandQueue({'goe': goe.set})  # target: function(command string) --> True if successful
+    id = command.submit('goe', 'amp=8')  -->  1
+    command.get(1)  -->  {'id': 1, 'target': 'goe', 'command': 'amp=8', 'status': 'done', 'executed': 'amp=8', ...}
+    """
+
+    def __init__(self, targets, retries=1, history=100, log_name='command'):
+        """
+        :param targets: Dictionary {target: function}, the function gets the command string, returns True if successful
+        :param retries: number of retries of a failed command
+        :param history: number of commands kept for the status query
+        """
+        self.log = logging.getLogger(log_name)
+        self.targets = targets
+        self.retries = retries
+        self.history = history
+        self.pending = {target: {} for target in targets}  # target: {parameter: (value, id)}
+        self.queued = {target: set() for target in targets}  # target: ids of waiting commands
+        self.commands = OrderedDict()  # id: status dictionary
+        self.ids = itertools.count(1)
+        self.condition = threading.Condition()
+        self.counter = {'submitted': 0, 'executed': 0, 'failed': 0, 'superseded': 0}
+        for target in targets:
+            threading.Thread(target=self.worker, args=(target,), daemon=True, name='command_' + target).start()
+
+    def submit(self, target, command):
+        """
+        Queue a command
+
+        :param target: target name, e.g. 'goe'
+        :param command: query string, e.g. 'amp=8&frc=0'
+        :return: command id or None if the target is not enabled
+        """
+        if target not in self.targets:
+            return None
+        parameters = parse_qsl(command, keep_blank_values=True)
+        with self.condition:
+            id = next(self.ids)
+            self.commands[id] = {'id': id, 'target': target, 'command': command,
+                                 'status': 'queued' if parameters else 'ignored', 'executed': None,
+                                 'time': time.time(), 'duration': None}
+            while len(self.commands) > self.history:
+                self.commands.popitem(last=False)
+            self.counter['submitted'] += 1
+            if parameters:
+                pending = self.pending[target]
+                for k, v in parameters:
+                    pending[k] = (v, id)
+                self.queued[target].add(id)
+                owners = set(owner for v, owner in pending.values())
+                for other in self.queued[target] - owners:  # all parameters replaced by later commands
+                    self.queued[target].discard(other)
+                    self.set_status(other, 'superseded')
+                    self.counter['superseded'] += 1
+                self.condition.notify_all()
+        self.log.debug("submit {} target={} command={}".format(id, target, command))
+        return id
+
+    def get(self, id):
+        """
+        Get the status of a command
+
+        :param id: command id
+        :return: Dictionary or None if unknown
+        """
+        with self.condition:
+            command = self.commands.get(id)
+            return dict(command) if command else None
+
+    def set_status(self, id, status, **kwargs):
+        if id in self.commands:  # may be removed from history
+            self.commands[id].update(status=status, **kwargs)
+
+    def worker(self, target):
+        """
+        Endless loop, execute the coalesced commands of a target.
+        """
+        function = self.targets[target]
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending[target])
+                pending, self.pending[target] = self.pending[target], {}
+                ids, self.queued[target] = self.queued[target], set()
+                command = urlencode([(k, v) for k, (v, id) in pending.items()])
+                for id in ids:
+                    self.set_status(id, 'running', executed=command)
+
+            t0 = time.perf_counter()
+            ok = False
+            for attempt in range(1 + self.retries):
+                try:
+                    ok = function(command)
+                except Exception as e:
+                    self.log.error("{} exception: {}".format(target, e))
+                if ok:
+                    break
+                self.log.info("{} command failed: {}, attempt {}".format(target, command, attempt + 1))
+
+            with self.condition:
+                for id in ids:
+                    self.set_status(id, 'done' if ok else 'failed', duration=round(time.perf_counter() - t0, 3))
+                self.counter['executed' if ok else 'failed'] += 1
+            self.log.info("{} command: {} {}".format(target, command, 'done' if ok else 'failed'))
+
+    def stats(self):
+        """
+        Get command statistics
+
+        :return: Dictionary
+        """
+        with self.condition:
+            return {**self.counter, 'queued': sum(len(ids) for ids in self.queued.values())}
+
+
+if __name__ == "__main__":
+    """
+    Simple Test for command module, slow target with rapid commands
+    """
+    logging.basicConfig(level=logging.DEBUG)
+
+    def slow_set(command):
+        time.sleep(0.5)
+        return 'frc=2' not in command  # frc=2 fails
+
+    queue = CommandQueue({'goe': slow_set})
+    ids = [queue.submit('goe', 'amp=6')]  # executed immediately
+    time.sleep(0.1)
+    ids += [queue.submit('goe', c) for c in ('amp=7&frc=0', 'amp=8', 'amp=10', '', 'frc=2')]  # coalesced while busy
+    print(queue.submit('unknown', 'amp=6'))
+    time.sleep(2)
+    for id in ids:
+        print(queue.get(id))
+    print(queue.stats())
@@ -0,0 +1,89 @@
+import logging
+import time
+
+
+class Scheduler:
+    """
+    Cycle scheduler for MeterHub
+
+    The cycles are started at fixed deadlines (start + tick * period), so the cycle time does not drift with the
+    duration of a cycle. Between two cycles the scheduler sleeps once until the next deadline. If a cycle takes longer
+    than the period, the next cycle is started immediately and the overrun is counted. Ticks which are completely
+    passed during an overrun are skipped and counted as missed.
+
+    scheduler = Scheduler(period=0.25)
+    while True:
+        t0 = scheduler.wait()  # sleep until next tick
+        ...
+    """
+
+    def __init__(self, period=1.0, log_name='scheduler'):
+        """
+        :param period: cycle time in seconds, e.g. 1 or 0.25
+        """
+        self.log = logging.getLogger(log_name)
+        self.period = period
+        self.t_start = None  # time of tick 0
+        self.tick = 0  # number of the current tick
+        self.cycles = 0  # number of started cycles
+        self.overruns = 0  # cycles started after their deadline
+        self.missed = 0  # ticks skipped completely
+        self.drift = 0  # delay of the latest cycle start to its deadline in seconds
+        self.drift_max = 0  # maximum delay
+
+    def wait(self):
+        """
+        Sleep until the next tick.
+
+        :return: Deadline of the started cycle (time.perf_counter)
+        """
+        now = time.perf_counter()
+        if self.t_start is None:  # first cycle starts immediately
+            self.t_start = now
+            tick = 0
+        else:
+            tick = self.tick + 1
+            deadline = self.t_start + tick * self.period
+            if now < deadline:
+                while now < deadline:  # single sleep, repeated only for an early wakeup
+                    time.sleep(deadline - now)
+                    now = time.perf_counter()
+            else:  # cycle overrun, start immediately with the latest passed tick
+                latest = int((now - self.t_start) / self.period)
+                self.overruns += 1
+                self.missed += latest - tick
+                self.log.debug("overrun {:.3f}s, {} ticks missed".format(now - deadline, latest - tick))
+                tick = latest
+
+        deadline = self.t_start + tick * self.period
+        self.tick = tick
+        self.cycles += 1
+        self.drift = now - deadline
+        self.drift_max = max(self.drift_max, self.drift)
+        return deadline
+
+    def stats(self):
+        """
+        Get scheduler statistics
+
+        :return: Dictionary
+        """
+        return {'period': self.period,
+                'cycles': self.cycles,
+                'overruns': self.overruns,
+                'missed': self.missed,
+                'drift': round(self.drift, 4),
+                'drift_max': round(self.drift_max, 4)}
+
+
+if __name__ == "__main__":
+    """
+    Simple Test for scheduler module, 250ms period with a single overrun
+    """
+    logging.basicConfig(level=logging.DEBUG)
+
+    scheduler = Scheduler(period=0.25)
+    for i in range(12):
+        t0 = scheduler.wait()
+        time.sleep(0.6 if i == 5 else 0.1)  # cycle 5 overruns, tick 6 is missed and tick 7 starts late
+    print(scheduler.stats())
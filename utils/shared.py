@@ -0,0 +1,231 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+magic = b'MHUB'
+header = struct.Struct('<4sIQIIq')  # magic, capacity, generation, seq, length, timestamp
+ident = struct.Struct('<4sI')  # magic, capacity, offset 0
+meta = struct.Struct('<IIq')  # seq, length, timestamp, offset 16
+
+
+class SharedExport:
+    """
+    Shared memory export of the latest dataset for local consumers (display, battery controller on the same Pi)
+
+    The main loop writes the JSON snapshot of every cycle to a memory mapped file (/dev/shm is RAM). A local process
+    maps the same file and reads the latest dataset without syscalls, sockets or HTTP.
+
+    Layout (little endian):
+
+    0   4s  magic 'MHUB'
+    4   I   capacity of the payload in bytes
+    8   Q   generation, odd while the writer changes the payload
+    16  I   sequence number of the cycle
+    20  I   length of the payload
+    24  q   timestamp of the dataset
+    32      payload, JSON of the dataset
+
+    The generation works as seqlock: the writer increments it before and after writing, a reader copies the payload
+    and retries if the generation was odd or has changed during the copy. There is a single writer, readers never
+    block it. The generation is accessed as aligned 64 bit word (memoryview), a single store. struct.pack_into is
+    not used for it, it clears the buffer before packing and a reader could see a new generation with old fields.
+
+    shared = SharedExport('/dev/shm/meterhub')
+    shared.write(snapshot)
+    """
+
+    def __init__(self, path='/dev/shm/meterhub', capacity=65536, log_name='shared'):
+        """
+        :param path: file, use a RAM filesystem (/dev/shm)
+        :param capacity: maximum size of the payload in bytes, rounded up to a multiple of 8 (64 bit words)
+        """
+        if not isinstance(capacity, int) or capacity <= 0:
+            raise ValueError("capacity {} must be a positive number of bytes".format(capacity))
+        capacity = (capacity + 7) & ~7  # the mapping is accessed as 64 bit words
+        self.log = logging.getLogger(log_name)
+        self.path = path
+        self.capacity = capacity
+        self.overflow = False  # payload larger than capacity, logged once
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            size = header.size + capacity
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)  # the mapping stays valid
+        self.words = memoryview(self.mm).cast('Q')  # words[1] is the generation
+        old_magic, old_capacity, gen, seq, length, timestamp = header.unpack_from(self.mm)
+        continued = old_magic == magic and old_capacity == capacity
+        # continue the generation of a previous run, readers with an old mapping see the new data
+        self.generation = (gen + 1) & ~1 if continued else 0
+        if not continued or gen & 1:  # new file or previous writer stopped while writing, clear the payload
+            self.words[1] = self.generation | 1
+            self.mm[:ident.size] = ident.pack(magic, capacity)  # fields are written without the generation word
+            meta.pack_into(self.mm, 16, 0, 0, 0)
+        self.words[1] = self.generation  # a continued dataset stays valid until the first write
+        self.log.info("shared export {} ({} bytes)".format(path, size))
+
+    def write(self, snapshot):
+        """
+        Write a snapshot, called by the main loop.
+
+        :param snapshot: Snapshot
+        :return: True if written, False if the dataset is larger than the capacity
+        """
+        body = snapshot.body
+        length = len(body)
+        if length > self.capacity:
+            if not self.overflow:
+                self.log.error("dataset with {} bytes larger than capacity {}".format(length, self.capacity))
+                self.overflow = True
+            return False
+        mm = self.mm
+        self.generation += 1
+        self.words[1] = self.generation  # odd, readers retry
+        mm[header.size:header.size + length] = body
+        meta.pack_into(mm, 16, snapshot.seq, length, snapshot.timestamp or 0)
+        self.generation += 1
+        self.words[1] = self.generation  # even, payload valid
+        return True
+
+    def close(self):
+        self.words.release()
+        self.mm.close()
+
+
+class SharedReader:
+    """
+    Reader for the shared memory export, for local processes
+
+    reader = SharedReader('/dev/shm/meterhub')
+    reader.get()  -->  {'time': '2022-09-25 00:05:57', 'timestamp': 1664049957, 'grid_p': 304, ...}
+    reader.read()  -->  (42, b'{"time":"2022-09-25 00:05:57",...}')
+    reader.wait(42, timeout=2)  -->  next dataset or None
+    """
+
+    def __init__(self, path='/dev/shm/meterhub'):
+        """
+        :param path: file of the SharedExport, FileNotFoundError if MeterHub has not created it so far
+        """
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:4] != magic:
+            raise ValueError("{} is not a MeterHub export".format(path))
+        self.words = memoryview(self.mm).cast('Q')  # words[1] is the generation
+        self.generation = None  # generation of the cached dataset
+        self.data = None  # cached dataset
+
+    @property
+    def seq(self):
+        """
+        Sequence number of the latest dataset, without copying the payload
+        """
+        return meta.unpack_from(self.mm, 16)[0]
+
+    def read(self, retries=100):
+        """
+        Read the latest payload
+
+        :param retries: maximum number of attempts while the writer is active
+        :return: (generation, seq, payload) or None if no dataset or no consistent copy was possible
+        """
+        mm, words = self.mm, self.words
+        for attempt in range(retries):
+            gen = words[1]
+            if not gen:
+                return None  # no dataset so far
+            if gen & 1:
+                time.sleep(0.0001)  # writer active, may be preempted while writing
+                continue
+            seq, length, timestamp = meta.unpack_from(mm, 16)
+            payload = mm[header.size:header.size + length]
+            if words[1] == gen:
+                return gen, seq, payload
+        return None
+
+    def get(self):
+        """
+        Get the latest dataset, decoded once per cycle.
+
+        :return: Dictionary or None if not available
+        """
+        if self.generation is not None and self.words[1] == self.generation:
+            return self.data  # unchanged, no copy
+        for attempt in range(3):
+            result = self.read()
+            if result is None:
+                return None
+            try:
+                self.data = json.loads(result[2])
+                self.generation = result[0]
+                return self.data
+            except ValueError:
+                pass  # torn copy despite the generation check, read again
+        return None
+
+    def wait(self, seq, timeout=10, interval=0.005):
+        """
+        Wait for a dataset newer than seq (polls the header, no syscall besides sleep)
+
+        :param seq: sequence number of the known dataset
+        :param timeout: timeout in seconds
+        :param interval: poll interval in seconds
+        :return: Dictionary or None after timeout
+        """
+        deadline = time.perf_counter() + timeout
+        while self.seq == seq:
+            if time.perf_counter() > deadline:
+                return None
+            time.sleep(interval)
+        return self.get()
+
+    def close(self):
+        self.words.release()
+        self.mm.close()
+
+
+if __name__ == "__main__":
+    """
+    Test for shared module, writer in this process, reader in a second process. The reader checks every copy for torn
+    data and measures the latency from write to read.
+    """
+    import multiprocessing
+    import random
+    from utils.snapshot import Snapshot
+
+    path = '/dev/shm/meterhub_test' if os.path.isdir('/dev/shm') else 'meterhub_test'
+    cycles = 2000
+
+    def reader_process(path, cycles, result):
+        reader = SharedReader(path)
+        torn, latency, seq = 0, [], 0
+        while seq < cycles:
+            data = reader.wait(seq, interval=0)  # busy poll
+            if data is None:
+                break
+            latency.append(time.perf_counter() - data['t'])
+            if data['a'] != data['b']:
+                torn += 1
+            seq = reader.seq
+        latency.sort()
+        result.put((torn, len(latency), latency[len(latency) // 2], latency[int(len(latency) * 0.99)]))
+
+    shared = SharedExport(path)
+    context = multiprocessing.get_context('fork')
+    result = context.Queue()
+    process = context.Process(target=reader_process, args=(path, cycles, result))
+    process.start()
+    time.sleep(0.5)
+    for i in range(1, cycles + 1):
+        text = 'x' * random.randint(0, 4000)  # varying length
+        shared.write(Snapshot({'timestamp': int(time.time()), 'a': text, 'b': text, 't': time.perf_counter()}, i))
+        time.sleep(0.001)
+    torn, reads, median, p99 = result.get()
+    process.join()
+    print("reads: {}  torn: {}  latency median: {:.1f}us  p99: {:.1f}us".format(reads, torn, median * 1e6, p99 * 1e6))
+    print("PASS" if not torn else "FAIL")
+    os.remove(path)
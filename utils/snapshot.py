@@ -0,0 +1,110 @@
+import json
+from functools import lru_cache
+
+
+class Snapshot:
+    """
+    Dataset snapshot for the webserver
+
+    The main loop creates one snapshot per cycle. The dataset is encoded to JSON once, every request serves the same
+    bytes without encoding. The ETag identifies the cycle (timestamp and sequence number, unique also for cycle times
+    below one second), a client with a matching If-None-Match header gets 304 until the next cycle.
+
+    A snapshot is not changed after creation, the webserver threads can use it without locking. Projections to a
+    subset of keys (/?keys=grid_p,pv_p) are encoded once per snapshot and key set.
+
+    snapshot = Snapshot(data, seq)
+    snapshot.body  -->  b'{"time":"2022-09-25 00:05:57","timestamp":1664049957,...}'
+    snapshot.etag  -->  '"1664049957-42"'
+    """
+
+    __slots__ = ('data', 'seq', 'timestamp', 'body', 'etag', 'projections', 'binary', 'schema')
+
+    def __init__(self, data, seq=0, encoder=None):
+        """
+        :param data: dataset (dictionary), must not be changed afterwards
+        :param seq: sequence number of the cycle
+        :param encoder: BinaryEncoder for /bin, None without binary encoding
+        """
+        self.data = data
+        self.seq = seq
+        self.timestamp = data.get('timestamp')
+        self.body = json.dumps(data, separators=(',', ':')).encode()
+        self.etag = '"{}-{}"'.format(self.timestamp, seq)
+        self.projections = {}  # keys parameter: encoded projection
+        self.binary = encoder.encode(data, seq) if encoder else None  # packed struct
+        self.schema = encoder.schema if encoder else None  # schema descriptor of the packed struct (JSON)
+
+    def project(self, keys):
+        """
+        Get a projection of the dataset to some keys, unknown keys are null.
+
+        :param keys: comma separated keys, e.g. 'grid_p,pv_p,bat_p'
+        :return: JSON (bytes)
+        """
+        body = self.projections.get(keys)
+        if body is None:
+            data = self.data
+            body = json.dumps({k: data.get(k) for k in projection(keys)}, separators=(',', ':')).encode()
+            if len(self.projections) < 32:  # cache popular key sets, not arbitrary ones
+                self.projections[keys] = body
+        return body
+
+    def newer(self, cursor):
+        """
+        Check if the snapshot is newer than a cursor
+
+        :param cursor: timestamp '1664049957' or timestamp with sequence number '1664049957-42' (ETag)
+        :return: True if newer
+        """
+        timestamp, seq = parse_cursor(cursor)
+        if self.timestamp != timestamp or seq is None:
+            return self.timestamp > timestamp
+        return self.seq > seq
+
+    def match(self, if_none_match):
+        """
+        Check an If-None-Match header
+
+        :param if_none_match: header value, e.g. '"1664049957-42"', a list or '*'
+        :return: True if the client has the current snapshot (304)
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        return self.etag in (tag.strip().replace('W/', '', 1) for tag in if_none_match.split(','))
+
+
+def parse_cursor(cursor):
+    """
+    Parse a cursor of a client
+
+    :param cursor: timestamp '1664049957' or timestamp with sequence number '1664049957-42' (ETag)
+    :return: (timestamp, seq or None), ValueError for an invalid cursor
+    """
+    timestamp, _, seq = cursor.strip('"').partition('-')
+    return int(timestamp), int(seq) if seq else None
+
+
+@lru_cache(maxsize=64)
+def projection(keys):
+    """
+    Parse the keys parameter once per key set
+
+    :param keys: comma separated keys
+    :return: tuple with unique keys in order of the request
+    """
+    return tuple(dict.fromkeys(k.strip() for k in keys.split(',') if k.strip()))
+
+
+if __name__ == "__main__":
+    """
+    Simple Test for snapshot module
+    """
+    snapshot = Snapshot({'time': '2022-09-25 00:05:57', 'timestamp': 1664049957, 'grid_p': 304}, seq=42)
+    print(snapshot.body, snapshot.etag)
+    print(snapshot.match('"1664049957-42"'), snapshot.match('W/"1664049957-42", "x"'), snapshot.match('"1-1"'))
+    print(snapshot.newer('1664049956'), snapshot.newer('1664049957'), snapshot.newer('1664049957-41'))
+    print(parse_cursor('"1664049957-42"'), parse_cursor('1664049957'))
+    print(snapshot.project('grid_p,timestamp,grid_p,bat_p'))
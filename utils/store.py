@@ -0,0 +1,94 @@
+import threading
+import time
+
+
+class Store:
+    """
+    Thread safe store for published values
+
+    Written by the webserver threads, read by the main loop. Every write creates a new dictionary under a lock and
+    swaps the reference (copy on write). A reader takes the reference once and gets a consistent version, all keys of
+    a single publish are visible together or not at all. Readers never lock and never block a writer for longer than
+    the copy of a few keys.
+
+    Expired values are not deleted by the reader, they are ignored. A value published again is never lost by a
+    concurrent cleanup.
+
+    store = Store({'bat_soc': 10, 'car_plug': 10})  # allowed keys with timeout in seconds, None without timeout
+    store.publish({'bat_soc': 85, 'foo': 1})  -->  ['bat_soc']
+    store.view()  -->  {'bat_soc': 85}
+    """
+
+    def __init__(self, timeouts):
+        """
+        :param timeouts: Dictionary with the allowed keys and their timeout in seconds, None for no timeout
+        """
+        self.timeouts = dict(timeouts)
+        self.values = {}  # key: (value, deadline), replaced on every write
+        self.lock = threading.Lock()  # serializes the writers
+
+    def publish(self, values):
+        """
+        Store values, keys which are not allowed are ignored.
+
+        :param values: Dictionary
+        :return: list with the stored keys
+        """
+        accepted = [k for k in values if k in self.timeouts]
+        if accepted:
+            t = time.perf_counter()
+            with self.lock:
+                new = dict(self.values)
+                for k in accepted:
+                    timeout = self.timeouts[k]
+                    new[k] = (values[k], t + timeout if timeout is not None else None)
+                self.values = new
+        return accepted
+
+    def view(self, t=None):
+        """
+        Get all valid values, consistent to a single version of the store.
+
+        :param t: time (time.perf_counter) for the timeouts, None for now
+        :return: Dictionary
+        """
+        values = self.values  # single reference, not changed by writers
+        t = time.perf_counter() if t is None else t
+        return {k: v for k, (v, deadline) in values.items() if deadline is None or t <= deadline}
+
+
+if __name__ == "__main__":
+    """
+    Stress test for store module, 300 threads publish and a reader checks every version for torn or lost updates
+    """
+    writers, cycles = 300, 200
+    store = Store({**{'a': None, 'b': None}, **{'w{}'.format(i): None for i in range(writers)}})
+    errors = []
+    done = threading.Event()
+
+    def writer(i):
+        for n in range(cycles):
+            store.publish({'a': (i, n), 'b': (i, n), 'w{}'.format(i): n, 'ignored': n})  # a and b are written together
+
+    def reader():
+        while not done.is_set():
+            view = store.view()
+            if view.get('a') != view.get('b'):
+                errors.append("torn update: {} {}".format(view.get('a'), view.get('b')))
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    read_thread = threading.Thread(target=reader)
+    read_thread.start()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    done.set()
+    read_thread.join()
+
+    view = store.view()
+    lost = [i for i in range(writers) if view.get('w{}'.format(i)) != cycles - 1]
+    print("{} writers x {} publishes in {:.2f}s".format(writers, cycles, time.perf_counter() - t0))
+    print("torn updates: {}  lost updates: {}  ignored key stored: {}".format(len(errors), len(lost), 'ignored' in view))
+    print("PASS" if not errors and not lost and 'ignored' not in view else "FAIL")
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+
+class Stream:
+    """
+    Server-Sent Events for MeterHub
+
+    Pushes every new dataset to the subscribers as soon as the main loop publishes it. An asyncio server in a single
+    thread serves all subscribers, an idle subscriber costs no thread. The events are encoded once per cycle and
+    shared by all subscribers.
+
+    Every subscriber has a bounded queue. A slow consumer (full queue) loses the queued events and continues with the
+    latest full dataset, so the main loop never waits for a subscriber.
+
+    http://192.168.0.10:8009/stream             event 'data' with the full dataset every cycle
+    http://192.168.0.10:8009/stream?delta=1     event 'data' with the full dataset, then 'delta' with changed keys
+    """
+
+    def __init__(self, port=8009, host='0.0.0.0', queue_size=8, heartbeat=15, log_name='stream'):
+        """
+        :param port: TCP port
+        :param queue_size: maximum number of queued events per subscriber
+        :param heartbeat: interval in seconds for a comment line, keeps the connection alive and detects lost clients
+        """
+        self.log = logging.getLogger(log_name)
+        self.port = port
+        self.host = host
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.loop = None
+        self.clients = set()  # client queues
+        self.snapshot = None  # latest published snapshot
+        self.event = None  # encoded full event of the latest snapshot
+        self.counter = {'clients': 0, 'events': 0, 'dropped': 0}
+
+    def start(self):
+        threading.Thread(target=lambda: asyncio.run(self.serve()), daemon=True).start()
+        return self
+
+    async def serve(self):
+        try:
+            server = await asyncio.start_server(self.handle, self.host, self.port)
+        except OSError as e:
+            self.log.error("stream on port {} not available: {}".format(self.port, e))  # publish() does nothing
+            return
+        self.loop = asyncio.get_running_loop()
+        self.log.info("stream on port {}".format(self.port))
+        async with server:
+            await server.serve_forever()
+
+    def publish(self, snapshot):
+        """
+        Publish a new snapshot, called by the main loop. Returns immediately, never raises if the server is not
+        running (port not available or stopped).
+
+        :param snapshot: Snapshot
+        """
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self.dispatch, snapshot)
+        except RuntimeError:  # closed meanwhile
+            pass
+
+    def dispatch(self, snapshot):
+        """
+        Encode the events of a snapshot once and queue them for all subscribers (event loop thread)
+        """
+        previous, self.snapshot = self.snapshot, snapshot
+        self.event = b'id: ' + snapshot.etag.strip('"').encode() + b'\nevent: data\ndata: ' + snapshot.body + b'\n\n'
+        delta = None
+        for queue in self.clients:
+            if queue.delta and queue.synced and previous is not None:
+                if delta is None:
+                    delta = encode_delta(previous, snapshot)
+                event = delta
+            else:
+                event = self.event
+            if queue.full():  # slow consumer, discard queued events and continue with the full dataset
+                while not queue.empty():
+                    queue.get_nowait()
+                self.counter['dropped'] += 1
+                event = self.event
+            queue.synced = True
+            queue.put_nowait(event)
+        self.counter['events'] += 1
+
+    async def handle(self, reader, writer):
+        """
+        Handle a single subscriber connection
+        """
+        queue = None
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            method, target = request.decode('latin1').split(' ', 2)[:2]
+            url = urlsplit(target)
+            if method != 'GET' or url.path != '/stream':
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                await writer.drain()
+                return
+
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: text/event-stream\r\n'
+                         b'Cache-Control: no-cache\r\n'
+                         b'Access-Control-Allow-Origin: *\r\n'
+                         b'Connection: keep-alive\r\n\r\n'
+                         b'retry: 2000\n\n')
+            queue = asyncio.Queue(self.queue_size)
+            queue.delta = parse_qs(url.query).get('delta', ['0'])[0] not in ('0', '')
+            queue.synced = self.event is not None
+            if self.event is not None:
+                queue.put_nowait(self.event)  # start with the latest full dataset
+            self.clients.add(queue)
+            self.counter['clients'] += 1
+            self.log.debug("subscriber {} delta={}".format(writer.get_extra_info('peername'), queue.delta))
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    event = b': heartbeat\n\n'
+                writer.write(event)
+                await writer.drain()  # TCP backpressure, a slow client fills its queue
+        except Exception as e:
+            self.log.debug("subscriber closed: {}".format(e))
+        finally:
+            if queue is not None:
+                self.clients.discard(queue)
+            writer.close()
+
+    def stats(self):
+        """
+        Get stream statistics
+
+        :return: Dictionary
+        """
+        return {'subscribers': len(self.clients), **self.counter}
+
+
+def encode_delta(previous, snapshot):
+    """
+    Encode the changed keys of a snapshot as 'delta' event
+
+    :param previous: previous Snapshot
+    :param snapshot: current Snapshot
+    :return: bytes
+    """
+    old = previous.data
+    delta = {k: v for k, v in snapshot.data.items() if k not in old or old[k] != v}
+    return (b'id: ' + snapshot.etag.strip('"').encode() + b'\nevent: delta\ndata: ' +
+            json.dumps(delta, separators=(',', ':')).encode() + b'\n\n')
+
+
+if __name__ == "__main__":
+    """
+    Simple Test for stream module, publish a dataset every second: curl -N http://127.0.0.1:8009/stream?delta=1
+    """
+    import time
+    from utils.snapshot import Snapshot
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    stream = Stream().start()
+    for i in range(60):
+        stream.publish(Snapshot({'time': time.strftime("%Y-%m-%d %H:%M:%S"), 'timestamp': int(time.time()),
+                                 'grid_p': 300 + i % 3, 'bat_soc': 46}, seq=i))
+        time.sleep(1)
@@ -1,85 +1,944 @@
 import json
-from bottle import route, response
+import math
+import threading
+from array import array
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+from bottle import request, route, response
+from utils.snapshot import projection
+
+nulls = {'b': -1, 'i': -2 ** 31, 'q': -2 ** 63, 'd': math.nan, 's': 0xFFFF}  # null values of the typed columns
+typecodes = {'b': 'b', 'i': 'i', 'q': 'q', 'd': 'd', 's': 'H'}
+enum_limit = 1024  # maximum number of strings of an enum column, e.g. 'time' is converted to fixed width text
+chunk = 1024  # rows decoded at once by a view
+functions = ('count', 'min', 'max', 'sum', 'first', 'last', 'avg')  # aggregate functions, see Trace.aggregate
+cache_limit = 20000  # maximum number of cached bucket statistics
+
+
+def kind(value):
+    """
+    Column kind for a value: 'b' bool, 'i' int32, 'q' int64, 'd' float, 's' string, 'o' other (object)
+    """
+    t = type(value)
+    if t is bool:
+        return 'b'
+    if t is int:
+        return 'i' if -2 ** 31 < value < 2 ** 31 else 'q' if -2 ** 63 < value < 2 ** 63 else 'o'
+    if t is float:
+        return 'd' if value == value else 'o'  # NaN is the null value
+    if t is str:
+        return 's'
+    return 'o'
+
+
+@lru_cache(maxsize=64)
+def json_template(keys):
+    """
+    Format string for a JSON object with encoded values, e.g. '{"grid_p": %s, "pv_p": %s}'
+
+    :param keys: tuple with keys
+    """
+    return '{' + ', '.join(json.dumps({key: None})[1:-7].replace('%', '%%') + ': %s' for key in keys) + '}'
+
+
+def rearrange(storage, segments, length, fill):
+    """
+    Copy segments of an array, list or bytearray in order and pad to length
+
+    :param segments: list with (start, stop)
+    :param fill: storage with a single null value
+    """
+    out = storage[0:0]
+    for p, q in segments:
+        out += storage[p:q]
+    return out + fill * (length - len(out))
+
+
+class Column:
+    """
+    Column of the trace, one value per ring position
+
+    n   no value so far         None
+    b   bool                    array('b'), null -1
+    i   int32                   array('i'), null -2147483648
+    q   int64                   array('q'), null -9223372036854775808
+    d   float                   array('d'), null NaN, with flags (bytearray, 1 for int) if ints and floats are mixed
+    s   string (enum)           array('H') with the index in strings, null 65535
+    t   string (fixed width)    bytearray with width bytes per row (ASCII), null zero bytes
+    o   other (object)          list
+
+    set() returns False if a value does not fit, promote() creates a column of a more general kind with all values.
+    A column object keeps its kind, a reader can use it without lock while the writer promotes.
+    """
+
+    __slots__ = ('kind', 'size', 'values', 'flags', 'strings', 'index', 'width', 'set')
+
+    def __init__(self, kind, size, flags=False, width=0):
+        """
+        :param kind: column kind
+        :param size: number of rows
+        :param flags: 'd' column with int flags
+        :param width: 't' column width in bytes
+        """
+        self.kind = kind
+        self.size = size
+        self.flags = bytearray(size) if flags else None
+        self.strings = []  # 's' strings, index is the stored value
+        self.index = {}  # 's' string: index
+        self.width = width
+        if kind in typecodes:
+            self.values = array(typecodes[kind], [nulls[kind]]) * size
+        elif kind == 't':
+            self.values = bytearray(size * width)
+        elif kind == 'o':
+            self.values = [None] * size
+        else:
+            self.values = None
+        self.set = getattr(self, 'set_' + kind)
+
+    def set_n(self, pos, value):
+        return value is None
+
+    def set_b(self, pos, value):
+        if value is None:
+            self.values[pos] = -1
+        elif type(value) is bool:
+            self.values[pos] = value
+        else:
+            return False
+        return True
+
+    def set_i(self, pos, value):
+        if value is None:
+            self.values[pos] = -2147483648
+        elif type(value) is int and -2147483648 < value < 2147483648:
+            self.values[pos] = value
+        else:
+            return False
+        return True
+
+    def set_q(self, pos, value):
+        if value is None:
+            self.values[pos] = -9223372036854775808
+        elif type(value) is int and -9223372036854775808 < value < 9223372036854775808:
+            self.values[pos] = value
+        else:
+            return False
+        return True
+
+    def set_d(self, pos, value):
+        flags = self.flags
+        if value is None:
+            self.values[pos] = math.nan
+        elif type(value) is float and value == value:
+            self.values[pos] = value
+        elif flags is not None and type(value) is int and -2 ** 53 <= value <= 2 ** 53:
+            self.values[pos] = value
+            flags[pos] = 1
+            return True
+        else:
+            return False
+        if flags is not None:
+            flags[pos] = 0
+        return True
+
+    def set_s(self, pos, value):
+        if value is None:
+            self.values[pos] = 0xFFFF
+            return True
+        if type(value) is not str:
+            return False
+        index = self.index.get(value)
+        if index is None:
+            if len(self.strings) >= enum_limit:
+                return False
+            index = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        self.values[pos] = index
+        return True
+
+    def set_t(self, pos, value):
+        width = self.width
+        if value is None:
+            self.values[pos * width:(pos + 1) * width] = bytes(width)
+        elif type(value) is str and len(value) == width and value.isascii() and '\x00' not in value:
+            self.values[pos * width:(pos + 1) * width] = value.encode()
+        else:
+            return False
+        return True
+
+    def set_o(self, pos, value):
+        self.values[pos] = value
+        return True
+
+    def promote(self, pos, value):
+        """
+        Create a column of a more general kind with all values of this column and value at pos.
+
+        :return: Column
+        """
+        new, old = kind(value), self.kind
+        options = {}
+        if old == 'n':
+            pass
+        elif old == 'i' and new == 'q':
+            pass
+        elif old in 'iqd' and new in 'iqd':  # ints and floats mixed
+            new, options = 'd', {'flags': True}
+        elif old == 's' and new == 's':  # too many strings
+            new, options = 't', {'width': len(value)}
+        else:
+            new = 'o'
+        if new == 't' and not options['width']:
+            new, options = 'o', {}
+
+        values = self.decode([(0, self.size)])
+        values[pos] = value
+        column = Column(new, self.size, **options)
+        for p, v in enumerate(values):
+            if not column.set(p, v):
+                column = Column('o', self.size)
+                column.values = values
+                break
+        return column
+
+    def decode(self, segments):
+        """
+        Get the values of ring positions
+
+        :param segments: list with (start, stop)
+        :return: list
+        """
+        kind = self.kind
+        if len(segments) > 1:
+            return [v for p, q in segments for v in self.decode([(p, q)])]
+        p, q = segments[0]
+        if kind == 'n':
+            return [None] * (q - p)
+        if kind == 'o':
+            return self.values[p:q]
+        if kind == 't':
+            width = self.width
+            text = self.values[p * width:q * width].decode()
+            values = [text[i:i + width] for i in range(0, len(text), width)]
+            if '\x00' in text:
+                null = '\x00' * width
+                values = [None if v == null else v for v in values]
+            return values
+        values = self.values[p:q].tolist()
+        if kind == 'd':
+            values = [v if v == v else None for v in values]
+            flags = self.flags
+            if flags is not None and flags.find(1, p, q) >= 0:
+                for i in range(q - p):
+                    if flags[p + i] and values[i] is not None:
+                        values[i] = int(values[i])
+            return values
+        null = nulls[kind]
+        if kind == 's':
+            strings = self.strings
+            return [None if v == null else strings[v] for v in values]
+        if null in values:
+            values = [None if v == null else v for v in values]
+        if kind == 'b':
+            return [None if v is None else v == 1 for v in values]
+        return values
+
+    def stats(self, segments):
+        """
+        Statistics of the numeric values of ring positions, null values are skipped. Computed on the array slices
+        with builtin functions (C loops), no Python object per value for min, max and sum.
+
+        :param segments: list with (start, stop)
+        :return: (count, min, max, sum, first, last) or None without values or for a column which is not numeric
+        """
+        kind = self.kind
+        if kind not in 'biqd':
+            return None
+        values = self.values[0:0]
+        for p, q in segments:
+            values += self.values[p:q]
+        total = sum(values)
+        if kind == 'd':
+            if total != total:  # NaN, remove null values
+                values = [v for v in values if v == v]
+                total = sum(values)
+        elif nulls[kind] in values:
+            null = nulls[kind]
+            values = [v for v in values if v != null]
+            total = sum(values)
+        if not values:
+            return None
+        result = (len(values), min(values), max(values), total, values[0], values[-1])
+        if kind == 'd' and self.flags is not None and any(self.flags.find(1, p, q) >= 0 for p, q in segments):
+            result = result[:1] + tuple(int(v) if v.is_integer() else v for v in result[1:])  # ints and floats
+        if kind == 'b':
+            result = result[:1] + tuple(map(bool, result[1:3])) + (total, bool(values[0]), bool(values[-1]))
+        return result
+
+    def text(self, segments):
+        """
+        Get the values of ring positions as text for CSV, same as "{}".format(value)
+
+        :return: list with strings
+        """
+        return list(map(str, self.decode(segments)))
+
+    def json(self, segments):
+        """
+        Get the values of ring positions JSON encoded, same as json.dumps(value)
+
+        :return: list with strings
+        """
+        values = self.decode(segments)
+        kind = self.kind
+        if kind in 'iqdn':
+            if kind == 'd' and (math.inf in values or -math.inf in values):
+                return list(map(json.dumps, values))  # Infinity
+            texts = list(map(repr, values))
+            if None in values:
+                texts = ['null' if v is None else t for v, t in zip(values, texts)]
+            return texts
+        if kind == 'o':
+            return list(map(json.dumps, values))
+        table = {None: 'null', True: 'true', False: 'false'} if kind == 'b' else \
+            {v: 'null' if v is None else encode_basestring_ascii(v) for v in set(values)}
+        return list(map(table.__getitem__, values))
+
+    def copy(self, segments, size):
+        """
+        Copy with the values of the segments in order, padded with null to size (resize of the trace)
+        """
+        column = Column.__new__(Column)
+        column.kind, column.size, column.width = self.kind, size, self.width
+        column.strings, column.index = list(self.strings), dict(self.index)
+        if self.kind in typecodes:
+            column.values = rearrange(self.values, segments, size, array(typecodes[self.kind], [nulls[self.kind]]))
+        elif self.kind == 't':
+            w = self.width
+            column.values = rearrange(self.values, [(p * w, q * w) for p, q in segments], size * w, bytearray(1))
+        elif self.kind == 'o':
+            column.values = rearrange(self.values, segments, size, [None])
+        else:
+            column.values = None
+        column.flags = rearrange(self.flags, segments, size, bytearray(1)) if self.flags is not None else None
+        column.set = getattr(column, 'set_' + column.kind)
+        return column
+
+
+class Ring:
+    """
+    Ring buffer with fixed capacity for the trace, columnar
+
+    Every key of the datasets has a column with a typed array (Column), a value is stored without a Python object
+    and the key is not repeated per row. The keys of a row in their order are stored as layout id, a view rebuilds
+    exactly the pushed dictionaries (same keys, order and values).
+
+    Rows are numbered continuously, row k is stored at position k % size. A push replaces the oldest row in O(1),
+    nothing is copied. Only the main loop writes, readers iterate without lock: before a row is replaced, `writing`
+    is set to the number of the new row, a reader which has been overtaken by the writer (row k + size) drops the row.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.end = 0  # number of the next row
+        self.writing = -1  # number of the row being written
+        self.columns = {}  # key: Column
+        self.layouts = []  # tuples with the keys of the rows
+        self.layout_ids = {}  # keys: index in layouts
+        self.layout = array('H', [0]) * size  # layout id per position
+        self.setters = {}  # layout id: set functions of the columns, see add_setters()
+
+    def __len__(self):
+        return min(self.end, self.size)
+
+    def append(self, data):
+        k = self.end
+        self.writing = k
+        pos = k % self.size
+        keys = tuple(data)
+        id = self.layout_ids.get(keys)
+        if id is None:
+            id = self.add_layout(keys)
+        self.layout[pos] = id
+        setters = self.setters.get(id)
+        if setters is None:
+            setters = self.add_setters(id, keys)
+        present, absent = setters
+        for set, value in zip(present, data.values()):
+            if not set(pos, value):
+                self.promote(pos, data)
+                break
+        for set in absent:
+            set(pos, None)  # key not in this dataset, no value of an older row remains
+        self.end = k + 1
+
+    def add_setters(self, id, keys):
+        """
+        Set functions of a layout: (columns of the keys in order, columns not in the layout)
+        """
+        columns = self.columns
+        if not columns.keys() >= set(keys):
+            for key in keys:
+                if key not in columns:
+                    columns[key] = Column('n', self.size)
+            self.setters.clear()  # other layouts miss the new columns
+        present = set(keys)
+        setters = self.setters[id] = ([columns[key].set for key in keys],
+                                      [column.set for key, column in columns.items() if key not in present])
+        return setters
+
+    def promote(self, pos, data):
+        """
+        Store a dataset with values which do not fit to their columns, the columns are promoted.
+        """
+        columns = self.columns
+        for key, value in data.items():
+            column = columns[key]
+            if not column.set(pos, value):
+                columns[key] = column.promote(pos, value)
+        self.setters.clear()
+
+    def add_layout(self, keys):
+        id = self.layout_ids[keys] = len(self.layouts)
+        self.layouts.append(keys)
+        if id > 0xFFFF and self.layout.typecode == 'H':
+            self.layout = array('I', self.layout)
+        return id
+
+    def segments(self, a, b):
+        """
+        Positions of the rows a..b-1
+
+        :return: list with (start, stop)
+        """
+        p = a % self.size
+        q = p + b - a
+        return [(p, q)] if q <= self.size else [(p, self.size), (0, q - self.size)]
+
+    def resized(self, size):
+        """
+        Copy of the ring with another size, the latest rows are kept.
+        """
+        ring = Ring(size)
+        n = min(len(self), size)
+        if n:
+            segments = self.segments(self.end - n, self.end)
+            ring.columns = {key: column.copy(segments, size) for key, column in self.columns.items()}
+            ring.layouts, ring.layout_ids = list(self.layouts), dict(self.layout_ids)
+            ring.layout = rearrange(self.layout, segments, size, array(self.layout.typecode, [0]))
+            ring.end = n
+        return ring
+
+    def range(self, start=0, stop=None):
+        """
+        Numbers of the rows for an index or slice as for a list, oldest row first
+
+        :return: (first, end)
+        """
+        first = max(self.end - self.size, 0)
+        start, stop, step = slice(start, stop).indices(self.end - first)
+        return first + start, first + max(start, stop)
+
+    def view(self, start=0, stop=None):
+        """
+        Ordered view, oldest row first, index and slice as for a list (view(-10) for the latest 10 rows).
+
+        :return: iterator
+        """
+        return self.rows(*self.range(start, stop))
+
+    def rows(self, a, b):
+        """
+        Rebuild the datasets of the rows a..b-1
+        """
+        for keys, values, count in self.runs(a, b, Column.decode):
+            for row in zip(*values) if keys else [()] * count:
+                yield dict(zip(keys, row))
+
+    def runs(self, a, b, encode, keys=None, select=None):
+        """
+        Decode the rows a..b-1 in chunks column by column
+
+        :param encode: function(column, segments) --> list, e.g. Column.decode or Column.json
+        :param keys: keys for all rows, None for the keys of every row (layout)
+        :param select: set of keys, only these keys of every row (layout), None for all
+        :return: iterator with (keys, list with a value list per key, number of rows) for consecutive rows with the
+                 same keys
+        """
+        selected = {}  # layout id: selected keys
+        for c in range(a, b, chunk):
+            n = min(c + chunk, b) - c
+            segments = self.segments(c, c + n)
+            columns = self.columns
+            if keys is not None:
+                values = [encode(columns[key], segments) for key in keys]
+                i = max(self.writing - self.size + 1 - c, 0)  # rows before i are replaced meanwhile
+                if i < n:
+                    yield keys, [v[i:] for v in values] if i else values, n - i
+                continue
+            layout, layouts = self.layout, self.layouts
+            ids = [id for p, q in segments for id in layout[p:q]]
+            unique = set(ids)
+            for id in unique:
+                if id not in selected:
+                    selected[id] = layouts[id] if select is None else tuple(k for k in layouts[id] if k in select)
+            decoded = {}
+            for id in unique:
+                for key in selected[id]:
+                    if key not in decoded:
+                        decoded[key] = encode(columns[key], segments)
+            i = max(self.writing - self.size + 1 - c, 0)
+            while i < n:
+                id = ids[i]
+                j = n
+                if len(unique) > 1:
+                    j = i + 1
+                    while j < n and ids[j] == id:
+                        j += 1
+                yield selected[id], [decoded[key][i:j] for key in selected[id]], j - i
+                i = j
+
+    def bisect(self, key, value, lo=None, left=False):
+        """
+        Binary search in a sorted numeric column (timestamp), O(log n)
+
+        :param lo: number of the first row to search, None for the oldest row
+        :param left: find the first row with a value greater than or equal to value
+        :return: number of the first row with a value greater than value
+        """
+        a, b = self.range()
+        if lo is not None:
+            a = min(max(a, lo), b)
+        column = self.columns.get(key)
+        if column is None or column.kind not in 'iqd':
+            return a
+        values, size = column.values, self.size
+        while a < b:
+            mid = (a + b) // 2
+            v = values[mid % size]
+            if v > value or left and v == value:  # null is the smallest value (NaN is never greater)
+                b = mid
+            else:
+                a = mid + 1
+        return a
+
+    def missing(self, a, b, keys):
+        """
+        Check if a key is missing in one of the rows a..b-1
+
+        :return: True if missing
+        """
+        used = set()
+        for p, q in self.segments(a, b) if b > a else []:
+            used.update(self.layout[p:q])
+        return any(not set(keys).issubset(self.layouts[id]) for id in used)
+
 
 class Trace:
     """
     Trace for MeterHub
 
-    The individual measurements are saved in a list. The length can be changed at runtime.
-    The trace buffer is available as CSV or JSON via the web server.
+    The individual measurements are saved in a columnar ring buffer, see Ring and Column. The length can be changed
+    at runtime without losing the latest datasets. The trace buffer is available as CSV or JSON via the web server.
 
     /trace/<SIZE>
     /trace/csv
     /trace/json
+    /trace/agg
     """
 
-    def __init__(self, size=0):
-        self.size = None
+    def __init__(self, size=0, max_size=345600):
+        """
+        :param size: number of datasets
+        :param max_size: maximum size, the columns are allocated for the full size (about 250 bytes per dataset)
+        """
+        self.max_size = max_size
+        self.lock = threading.Lock()  # serializes push and resize
+        self.ring = Ring(0)
+        self.cache = {}  # (key, bucket, start): (rows, statistics) of closed buckets, see aggregate()
+        self.cache_lock = threading.Lock()  # serializes changes of the cache by the webserver threads
         self.set_size(size)
-        self.data = []
-        print("init")
+
+    @property
+    def size(self):
+        return self.ring.size
+
+    @property
+    def data(self):
+        """
+        List with all datasets, oldest first (copy)
+        """
+        return list(self.view())
+
+    def __len__(self):
+        return len(self.ring)
 
     def push(self, data):
         """
         Push dataset to trace buffer
         """
-        if data and self.size > 0:
-            self.data.append(data)
-            self.data = self.data[-self.size:]  # limit to maximum length
+        if data and self.ring.size > 0:
+            with self.lock:
+                self.ring.append(data)
 
     def set_size(self, size):
         """
-        Set size (number) of stored trace datasets
+        Set size (number) of stored trace datasets, the latest datasets are kept. Sizes above max_size are ignored.
+        """
+        if isinstance(size, int) and 0 <= size <= self.max_size and size != self.ring.size:
+            with self.lock:
+                self.ring = self.ring.resized(size)  # readers of the old ring continue with it
+        return self.ring.size
+
+    def view(self, start=0, stop=None):
+        """
+        Ordered view of the datasets, oldest first. Index and slice as for a list. The datasets are rebuilt from the
+        columns, changes do not affect the trace.
+
+        trace.view()  -->  all datasets
+        trace.view(-60)  -->  latest 60 datasets
+
+        :return: iterator
         """
-        if isinstance(size, int) and size >= 0:
-            self.size = size
-        return self.size
+        return self.ring.view(start, stop)
 
     def get_csv(self, columns=None):
         """
         Get trace data as CSV
         """
-        try:
-            if columns is None:  # retrive columns from first dataset
-                columns = list(sorted(self.data[0].keys()))
-                # set 'time' and 'timestamp' to the left for sorted colums
-                if 'timestamp' in columns:
-                    columns.remove('timestamp')
-                    columns = ['timestamp'] + columns
-                if 'time' in columns:
-                    columns.remove('time')
-                    columns = ['time'] + columns
-
-            csv = ";".join(columns) + '\n'
-            for d in self.data:
-                csv += ";".join(["{}".format(d[c]) for c in columns]) + '\n'
-        except:
-            csv = ''
-        return csv
+        return ''.join(self.iter_csv(columns))
+
+    def iter_csv(self, columns=None, since=None):
+        """
+        Trace data as CSV in chunks, for a streaming response. Empty if a column is missing in a dataset.
+
+        :param columns: keys, None for all keys of the first dataset (sorted, 'time' and 'timestamp' first)
+        :param since: timestamp, only datasets with a newer timestamp, None for all
+        :return: iterator with strings
+        """
+        ring = self.ring
+        a, b = ring.range()
+        if since is not None:
+            a = ring.bisect('timestamp', since)
+        if columns is None:  # retrive columns from first dataset
+            if a == b:
+                return
+            columns = list(sorted(ring.layouts[ring.layout[ring.segments(a, a + 1)[0][0]]]))
+            # set 'time' and 'timestamp' to the left for sorted colums
+            if 'timestamp' in columns:
+                columns.remove('timestamp')
+                columns = ['timestamp'] + columns
+            if 'time' in columns:
+                columns.remove('time')
+                columns = ['time'] + columns
+        columns = tuple(columns)
+        if ring.missing(a, b, columns):
+            return
+        yield ";".join(columns) + '\n'
+        for keys, values, count in ring.runs(a, b, Column.text, columns):
+            yield '\n'.join(map(';'.join, zip(*values) if keys else [()] * count)) + '\n'
+
+    def iter_json(self, columns=None, since=None):
+        """
+        Trace data as JSON list in chunks, for a streaming response. Same as json.dumps(trace.data).
+
+        :param columns: keys, only these keys of the datasets, None for all
+        :param since: timestamp, only datasets with a newer timestamp, None for all
+        :return: iterator with strings
+        """
+        ring = self.ring
+        a, b = ring.range()
+        if since is not None:
+            a = ring.bisect('timestamp', since)
+        separator = '['
+        for keys, values, count in ring.runs(a, b, Column.json, select=set(columns) if columns else None):
+            yield separator + ', '.join(map(json_template(keys).__mod__, zip(*values) if keys else [()] * count))
+            separator = ', '
+        yield '[]' if separator == '[' else ']'
+
+    def aggregate(self, keys, bucket=60, fns=('min', 'max', 'avg'), since=None):
+        """
+        Aggregate the trace to time buckets, e.g. minute values of a day for a chart.
+
+        A bucket starts at a multiple of bucket seconds, buckets without datasets are left out. The statistics of a
+        bucket are computed on the array slices of the columns (Column.stats). Closed buckets (a newer dataset
+        exists) which are complete in the trace are cached, a repeated query computes only the open bucket.
+
+        trace.aggregate(['grid_p'], 60, ['min', 'max'])
+            -->  [{'timestamp': 1664049900, 'count': 43, 'grid_p': {'min': -1783, 'max': 2950}}, ...]
+
+        :param keys: keys of numeric values, None for a key without values in a bucket or with other values
+        :param bucket: length of a bucket in seconds
+        :param fns: functions of count, min, max, sum, first, last, avg
+        :param since: timestamp, only datasets with a newer timestamp, None for all
+        :return: list with a dictionary per bucket, oldest first
+        """
+        for fn in fns:
+            if fn not in functions:
+                raise ValueError("unknown function {}, use {}".format(fn, ','.join(functions)))
+        ring = self.ring
+        first, b = ring.range()
+        a = first if since is None else ring.bisect('timestamp', since)
+        column = ring.columns.get('timestamp')
+        if column is None or column.kind not in 'iqd' or a == b:
+            return []
+        timestamps, size, null = column.values, ring.size, nulls[column.kind]
+        newest = timestamps[(b - 1) % size]
+        cache, result = self.cache, []
+        while a < b:
+            ts = timestamps[a % size]
+            if ts == null or ts != ts:
+                a += 1  # dataset without timestamp
+                continue
+            start = ts - ts % bucket
+            end = ring.bisect('timestamp', start + bucket, a, left=True)
+            closed = newest >= start + bucket and (a == 0 or a > first and timestamps[(a - 1) % size] < start)
+            segments = ring.segments(a, end)
+            row = {'timestamp': start, 'count': end - a}
+            for key in keys:
+                stats = None
+                entry = cache.get((key, bucket, start)) if closed else None
+                if entry is not None and entry[0] == end - a:
+                    stats = entry[1]
+                elif key in ring.columns:
+                    stats = ring.columns[key].stats(segments)
+                    if closed:
+                        with self.cache_lock:
+                            cache[(key, bucket, start)] = (end - a, stats)
+                if stats is None:
+                    row[key] = None
+                else:
+                    count, low, high, total, first_value, last_value = stats
+                    values = {'count': count, 'min': low, 'max': high, 'sum': total, 'first': first_value,
+                              'last': last_value, 'avg': round(total / count, 3)}
+                    row[key] = {fn: values[fn] for fn in fns}
+            if a >= ring.writing - size + 1:  # else rows of the bucket are replaced meanwhile
+                result.append(row)
+            a = end
+        if len(cache) > cache_limit:
+            self.prune(timestamps[max(ring.writing - size + 1, 0) % size])
+        return result
+
+    def prune(self, oldest):
+        """
+        Remove the cached buckets which are no longer in the trace, all if the cache is still too large
+
+        :param oldest: timestamp of the oldest dataset
+        """
+        with self.cache_lock:
+            for entry in [entry for entry in self.cache if entry[2] < oldest]:
+                del self.cache[entry]
+            if len(self.cache) > cache_limit:
+                self.cache.clear()
+
+    def lttb(self, keys, points=500, since=None):
+        """
+        Downsample the trace for a chart with Largest-Triangle-Three-Buckets, the shape (peaks) is kept.
+
+        trace.lttb(['grid_p'], 500)  -->  {'grid_p': [[1664049957, 304], [1664050129, 2950], ...]}
+
+        :param keys: keys of numeric values
+        :param points: maximum number of points per key
+        :param since: timestamp, only datasets with a newer timestamp, None for all
+        :return: dictionary with a list of [timestamp, value] per key, datasets without value are skipped
+        """
+        ring = self.ring
+        a, b = ring.range()
+        if since is not None:
+            a = ring.bisect('timestamp', since)
+        result = {}
+        for key in keys:
+            column = ring.columns.get(key)
+            if column is None or column.kind not in 'biqd' or 'timestamp' not in ring.columns:
+                result[key] = []
+                continue
+            x, y = [], []
+            for run_keys, (timestamps, values), count in ring.runs(a, b, Column.decode, ('timestamp', key)):
+                for t, v in zip(timestamps, values):
+                    if t is not None and v is not None:
+                        x.append(t)
+                        y.append(v)
+            result[key] = lttb(x, y, points)
+        return result
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling (Sveinn Steinarsson, 2013)
+
+    The first and the last point are kept, from every bucket in between the point with the largest triangle to the
+    point selected before and the average of the next bucket.
+
+    :param x: list with the x values (timestamps), ascending
+    :param y: list with the y values
+    :param threshold: number of points
+    :return: list with [x, y]
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return [[t, v] for t, v in zip(x, y)]
+    every = (n - 2) / (threshold - 2)
+    out = [[x[0], y[0]]]
+    a = 0
+    for i in range(threshold - 2):
+        p, q = int(i * every) + 1, int((i + 1) * every) + 1  # this bucket
+        r = min(int((i + 2) * every) + 1, n)  # next bucket q..r-1
+        avg_x, avg_y = sum(x[q:r]) / (r - q), sum(y[q:r]) / (r - q)
+        ax, ay = x[a], y[a]
+        dx, dy = ax - avg_x, avg_y - ay
+        area, a = -1, p
+        for j in range(p, q):
+            s = abs(dx * (y[j] - ay) - (ax - x[j]) * dy)
+            if s > area:
+                area, a = s, j
+        out.append([x[a], y[a]])
+    out.append([x[n - 1], y[n - 1]])
+    return out
 
 
 trace = Trace(size=600)
 
 
 @route("/trace")
-@route("/trace/<size>")
+@route("/trace/<size:int>")
 def trace_set(size=None):
+    if size is not None and size > trace.max_size:
+        response.status = 400
+        return "invalid size={}, maximum {}".format(size, trace.max_size)
     return "trace.size={}".format(trace.set_size(size))
 
 
+def trace_query():
+    """
+    Parse the query of /trace/json and /trace/csv: ?since=<timestamp>&columns=grid_p,pv_p
+
+    :return: (columns, since), ValueError for an invalid since
+    """
+    since = request.query.get('since')
+    columns = request.query.get('columns')
+    return projection(columns) if columns else None, float(since) if since else None
+
+
 @route("/trace/json")
 def trace_json():
+    try:
+        columns, since = trace_query()
+    except ValueError:
+        response.status = 400
+        return "invalid since={}, use a timestamp".format(request.query.get('since'))
     response.content_type = 'application/json'
-    return json.dumps(trace.data)
+    return trace.iter_json(columns, since)  # streaming, chunked transfer
 
 
 @route("/trace/csv")
 def trace_csv():
+    try:
+        columns, since = trace_query()
+    except ValueError:
+        response.status = 400
+        return "invalid since={}, use a timestamp".format(request.query.get('since'))
     response.content_type = 'text/plain'
-    return trace.get_csv()
+    return trace.iter_csv(columns, since)  # streaming, chunked transfer
+
+
+@route("/trace/agg")
+def trace_agg():
+    """
+    Aggregated or downsampled trace for charts
+
+    /trace/agg?keys=grid_p,pv_p&bucket=60&fn=min,max,avg&since=<timestamp>
+    /trace/agg?keys=grid_p,pv_p&mode=lttb&points=500&since=<timestamp>
+    """
+    query = request.query
+    try:
+        keys = projection(query.get('keys', ''))
+        if not keys:
+            raise ValueError("keys missing")
+        since = float(query.get('since')) if query.get('since') else None
+        mode = query.get('mode', 'agg')
+        if mode == 'lttb':
+            points = int(query.get('points', 500))
+            if points < 3:
+                raise ValueError("points={}, minimum 3".format(points))
+            result = trace.lttb(keys, points, since)
+        elif mode == 'agg':
+            bucket = int(query.get('bucket', 60))
+            if bucket < 1:
+                raise ValueError("bucket={}, minimum 1".format(bucket))
+            result = trace.aggregate(keys, bucket, projection(query.get('fn', 'min,max,avg')), since)
+        else:
+            raise ValueError("mode={}, use agg or lttb".format(mode))
+    except ValueError as e:
+        response.status = 400
+        return "invalid query: {}".format(e)
+    response.content_type = 'application/json'
+    return json.dumps(result)
 
 
 if __name__ == "__main__":
+    """
+    Test for trace module, a day of datasets: output identical to a list of dictionaries, memory of both
+    """
+    import random
+    import time
+    import tracemalloc
+
     trace.push({'a': 1, 'b': 2})
     trace.push({'a': 10, 'b': 20})
     print(trace.get_csv(columns=('a', 'b')))
+
+    trace = Trace(size=5)
+    for i in range(8):
+        trace.push({'a': i})
+    print(len(trace), [d['a'] for d in trace.view()], [d['a'] for d in trace.view(-2)])  # 5 [3, 4, 5, 6, 7] [6, 7]
+    trace.set_size(10)
+    trace.push({'a': 8})
+    print(len(trace), [d['a'] for d in trace.view()])  # 6 [3, 4, 5, 6, 7, 8]
+    trace.set_size(3)
+    print(len(trace), [d['a'] for d in trace.view()])  # 3 [6, 7, 8]
+
+    def dataset(i):
+        r = random.Random(i)
+        data = {'time': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1664049957 + i)), 'timestamp': 1664049957 + i,
+                'grid_imp_eto': 4539537 + i // 10, 'grid_p': r.randint(-3000, 3000), 'pv_p': r.choice((0, 1.5, None))}
+        data.update({'home_u{}'.format(n): round(r.uniform(228, 233), 1) for n in range(10)})
+        data.update({'home_p{}'.format(n): r.randint(0, 2000) for n in range(20)})
+        data.update({'car_stop': r.random() < 0.5, 'car_state': r.choice(('idle', 'charge', 'complete')),
+                     'big': 2 ** 40 if i % 1000 == 500 else 1, 'info': {'soc': 46} if i % 100 == 0 else None})
+        if i % 3:
+            data['measure_sdm72'] = round(r.uniform(0.02, 0.2), 3)  # key missing in some rows
+        return data
+
+    n = 86400
+    tracemalloc.start()
+    reference = [dataset(i) for i in range(n)]
+    list_memory = tracemalloc.get_traced_memory()[0]
+    trace = Trace(size=n)
+    for d in reference:
+        trace.push(d)
+    columnar_memory = tracemalloc.get_traced_memory()[0] - list_memory
+    tracemalloc.stop()
+    expected = json.dumps(reference)
+    same = json.dumps(trace.data) == expected and ''.join(trace.iter_json()) == expected
+    columns = ['time', 'timestamp'] + sorted(set(reference[0]) - {'time', 'timestamp'})
+    csv = ";".join(columns) + '\n' + ''.join(";".join("{}".format(d[c]) for c in columns) + '\n' for d in reference)
+    print("{} rows  list: {:.1f} MB  columnar: {:.1f} MB  json identical: {}  csv identical: {}".format(
+        n, list_memory / 1e6, columnar_memory / 1e6, same, trace.get_csv() == csv))
+    print({key: column.kind for key, column in trace.ring.columns.items()})
+
+    buckets = {}
+    for d in reference:
+        buckets.setdefault(d['timestamp'] - d['timestamp'] % 60, []).append(d['grid_p'])
+    expected = [{'timestamp': t, 'count': len(v),
+                 'grid_p': {'min': min(v), 'max': max(v), 'avg': round(sum(v) / len(v), 3)}}
+                for t, v in buckets.items()]
+    t0 = time.perf_counter()
+    aggregated = trace.aggregate(['grid_p'], 60)
+    t1 = time.perf_counter()
+    cached = trace.aggregate(['grid_p'], 60)
+    t2 = time.perf_counter()
+    points = trace.lttb(['grid_p'], 500)['grid_p']
+    t3 = time.perf_counter()
+    print("aggregate identical: {} (cached: {})  {:.1f} ms  cached: {:.1f} ms  lttb: {} points {:.1f} ms".format(
+        aggregated == expected, cached == expected, (t1 - t0) * 1e3, (t2 - t1) * 1e3, len(points), (t3 - t2) * 1e3))